@@ -3,6 +3,7 @@ import matplotlib.pyplot as plt
 import csv
 from tqdm import tqdm
 import os
+import functools
 
 REPETITIONS = 10_000_000
 MAX_DIMENSIONS = 10000
@@ -18,14 +19,63 @@ def simulate(dimension, repetitions=REPETITIONS):
     B = rng.random((dimension, repetitions))
     return np.linalg.norm(A - B, axis=0).mean()
 
+def simulate_streaming(dimension, repetitions=REPETITIONS, block_elements=2**16, generator=None):
+    """
+    Same as `simulate`, but with constant memory: the points are generated in blocks of about `block_elements`
+    coordinates (a few hundred KB, so they stay in cache), the squared distances are summed in place,
+    and the mean and variance of the distances are kept as running values.
+    Returns the mean distance and its standard error (both nan for 0 repetitions, like `simulate`).
+    """
+    if repetitions <= 0:
+        return float("nan"), float("nan")
+    generator = rng if generator is None else generator
+    reps_per_block = min(repetitions, 4096)
+    dims_per_block = max(1, min(dimension, block_elements // reps_per_block))
+    a_buffer = np.empty(dims_per_block * reps_per_block)
+    b_buffer = np.empty(dims_per_block * reps_per_block)
+    squared_buffer = np.empty(reps_per_block)
+    
+    count, mean, m2 = 0, 0.0, 0.0
+    for start in range(0, repetitions, reps_per_block):
+        reps = min(reps_per_block, repetitions - start)
+        squared = squared_buffer[:reps]
+        squared[:] = 0
+        for first_dim in range(0, dimension, dims_per_block):
+            dims = min(dims_per_block, dimension - first_dim)
+            # Contiguous views of the start of the buffers, so the random numbers can be written straight into them.
+            a = a_buffer[:dims * reps].reshape(dims, reps)
+            b = b_buffer[:dims * reps].reshape(dims, reps)
+            generator.random(out=a)
+            generator.random(out=b)
+            np.subtract(a, b, out=a)
+            np.multiply(a, a, out=a)
+            squared += a.sum(axis=0)
+        distances = np.sqrt(squared)
+        
+        # Merge the block into the running mean and sum of squared deviations (Chan et al.).
+        block_mean = distances.mean()
+        block_m2 = ((distances - block_mean) ** 2).sum()
+        delta = block_mean - mean
+        total = count + reps
+        mean += delta * reps / total
+        m2 += block_m2 + delta ** 2 * count * reps / total
+        count = total
+    
+    standard_error = np.sqrt(m2 / (count - 1) / count) if count > 1 else float("nan")
+    return mean, standard_error
+
 def simulate_many(max_dim=MAX_DIMENSIONS, granularity=GRANULARITY):
     rr = np.unique(np.geomspace(1, max_dim, num=granularity).astype('int64'))
     results = []
+    errors = []
     for dim in tqdm(rr):
         reps = REPETITIONS//dim
-        results.append(simulate(dim, repetitions=reps))
+        mean, error = simulate_streaming(dim, repetitions=reps)
+        results.append(mean)
+        errors.append(error)
     results = np.array(results)
-    return rr, results
+    errors = np.array(errors)
+    return rr, results, errors
 
 def plot_results(xx, yy, folder_path, file_name, xlabel="", ylabel="", save_figure=True):
     plt.plot(xx, yy, '-o')
@@ -33,27 +83,97 @@ def plot_results(xx, yy, folder_path, file_name, xlabel="", ylabel="", save_figu
     ax.set_xlabel(xlabel)
     ax.set_ylabel(ylabel)
     
-    file_name = f"seed_{SEED}_dim_{MAX_DIMENSIONS}_reps_{REPETITIONS}_gran_{GRANULARITY}.png"
     file_path = os.path.join(folder_path, file_name)
     plt.savefig(file_path)
     
     plt.show(block=True)
     
     
-def save_results_to_csv(xx, yy, folder_path, file_name):
+def save_results_to_csv(xx, yy, folder_path, file_name, errors=None):
     file_path = os.path.join(folder_path, file_name)
     
     with open(file_path, 'w', newline='') as csvfile:
         writer = csv.writer(csvfile, delimiter=";")
-        for x, y in zip(xx, yy):
-            writer.writerow([x, y])
+        if errors is None:
+            for x, y in zip(xx, yy):
+                writer.writerow([x, y])
+        else:
+            for x, y, e in zip(xx, yy, errors):
+                writer.writerow([x, y, e])
+
+def load_results_from_csv(folder_path, file_name):
+    """
+    Reads the rows written by `save_results_to_csv` or `sweep`, sorted by dimension.
+    A last row without its newline was cut off by a crash, and is skipped.
+    """
+    file_path = os.path.join(folder_path, file_name)
+    rows = []
+    if os.path.exists(file_path):
+        with open(file_path, newline='') as csvfile:
+            for line in csvfile:
+                row = next(csv.reader([line], delimiter=";"))
+                if line.endswith("\n") and len(row) in (2, 3):
+                    rows.append((int(row[0]), float(row[1]), float(row[2]) if len(row) > 2 else float("nan")))
+    rows.sort()
+    xx = np.array([r[0] for r in rows], dtype='int64')
+    yy = np.array([r[1] for r in rows])
+    errors = np.array([r[2] for r in rows])
+    return xx, yy, errors
+
+def _simulate_dimension(dim, repetitions, seed):
+    # Every dimension has its own stream, derived from the seed and the dimension only,
+    # so the result doesn't depend on which worker runs it, in which order, or what was done before a restart.
+    generator = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(int(dim),)))
+    mean, error = simulate_streaming(dim, repetitions=repetitions//dim, generator=generator)
+    return dim, mean, error
+
+def sweep(folder_path, file_name, max_dim=MAX_DIMENSIONS, granularity=GRANULARITY, repetitions=None, seed=None, processes=None):
+    """
+    `simulate_many` spread over a process pool. Every finished dimension is appended to the CSV right away,
+    and dimensions already in the file are skipped, so an interrupted sweep continues where it stopped
+    (resume with the same `repetitions` and `seed`, REPETITIONS and SEED by default).
+    If a dimension fails, the others are still written, and the first error is raised at the end.
+    Returns all the results in the file, sorted by dimension.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    repetitions = REPETITIONS if repetitions is None else repetitions
+    seed = SEED if seed is None else seed
+    rr = np.unique(np.geomspace(1, max_dim, num=granularity).astype('int64'))
+    done = set(load_results_from_csv(folder_path, file_name)[0].tolist())
+    todo = [int(dim) for dim in rr if dim not in done]
+    
+    file_path = os.path.join(folder_path, file_name)
+    if os.path.exists(file_path):
+        # Drop a row cut off by a crash, so the next row doesn't get glued onto it.
+        with open(file_path, 'rb+') as csvfile:
+            content = csvfile.read()
+            csvfile.truncate(content.rfind(b"\n") + 1)
+    
+    simulate_dimension = functools.partial(_simulate_dimension, repetitions=repetitions, seed=seed)
+    with open(file_path, 'a', newline='') as csvfile, ProcessPoolExecutor(processes) as pool:
+        writer = csv.writer(csvfile, delimiter=";")
+        # Biggest dimensions first: they take the longest, so the pool doesn't end on one slow task.
+        futures = [pool.submit(simulate_dimension, dim) for dim in sorted(todo, reverse=True)]
+        errors = []
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            try:
+                row = future.result()
+            except Exception as error:
+                errors.append(error)
+                continue
+            writer.writerow(row)
+            csvfile.flush()
+            os.fsync(csvfile.fileno())
+    if errors:
+        raise errors[0]
+    return load_results_from_csv(folder_path, file_name)
 
 def main():
-    xx, yy = simulate_many(MAX_DIMENSIONS)
-    figurefilename = f"seed_{SEED}_dim_{MAX_DIMENSIONS}_reps_{REPETITIONS}_gran_{GRANULARITY}.csv"
+    # Own file: the older outputs without "_sweep" come from the single sequential `rng`, not the per-dimension streams.
+    csvfilename = f"seed_{SEED}_dim_{MAX_DIMENSIONS}_reps_{REPETITIONS}_gran_{GRANULARITY}_sweep.csv"
+    xx, yy, errors = sweep(output_folder_path, csvfilename)
+    figurefilename = f"seed_{SEED}_dim_{MAX_DIMENSIONS}_reps_{REPETITIONS}_gran_{GRANULARITY}_sweep.png"
     plot_results(xx, yy, output_folder_path, figurefilename, "Dimensions", "Average distance")
-    csvfilename = f"seed_{SEED}_dim_{MAX_DIMENSIONS}_reps_{REPETITIONS}_gran_{GRANULARITY}.csv"
-    save_results_to_csv(xx, yy, output_folder_path, csvfilename)
     
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,8 +1,12 @@
 import numpy as np
 import math
+import numba
+import queue
+import threading
 from matplotlib import pyplot as plt
+from matplotlib.colors import to_rgb
 from matplotlib.animation import PillowWriter
-from typing import Optional, Union, Literal
+from typing import Callable, Optional, Union, Literal
 
 class Boid:
     top_speed = 0.2
@@ -120,20 +124,76 @@ class Boid:
     def __hash__(self):
         return hash(tuple(self.position, self.heading, self.color))
             
+
+class SpatialGrid:
+    """
+    Uniform grid (cell list) over the world, used to find the boids that can see each other without comparing every pair.
+    Cells are at least `Boid.flock_threshhold` wide, so every boid a boid can see is in its own cell or in one of the 8 around it.
+    Without a `cell_size`, the threshold is read again at every rebuild, so changing `Boid.flock_threshhold` resizes the grid.
+    """
+    def __init__(self, boundaries, cell_size:Optional[float]=None):
+        self.boundaries = boundaries
+        self.cell_size = cell_size
+        self.cells:dict[tuple[int, int], list[int]] = {}
+        self.resize()
+        
+    def resize(self) -> None:
+        cell_size = Boid.flock_threshhold if self.cell_size is None else self.cell_size
+        # Round the number of cells down so the cells are never narrower than `cell_size`.
+        self.shape = (max(1, int(self.boundaries[0] // cell_size)), max(1, int(self.boundaries[1] // cell_size)))
+        self.cell_width = self.boundaries[0] / self.shape[0]
+        self.cell_height = self.boundaries[1] / self.shape[1]
+        
+    def cell_of(self, position:np.array) -> tuple[int, int]:
+        # `Boid.advance` wraps positions into [0, boundary], so the upper edge is clamped into the last cell.
+        cx = min(int(position[0] / self.cell_width), self.shape[0] - 1)
+        cy = min(int(position[1] / self.cell_height), self.shape[1] - 1)
+        return cx, cy
+        
+    def rebuild(self, boids:list[Boid]) -> None:
+        self.resize()
+        self.cells = {}
+        for i, b in enumerate(boids):
+            self.cells.setdefault(self.cell_of(b.position), []).append(i)
+            
+    def candidates(self, position:np.array) -> list[int]:
+        """
+        Indices of the boids in the 3x3 block of cells around `position`, in the same order as the list the grid was built from.
+        The block doesn't wrap around the edges: `Boid.can_see` uses the plain distance, so boids on opposite edges never see each other.
+        """
+        cx, cy = self.cell_of(position)
+        indices = []
+        for x in range(max(cx - 1, 0), min(cx + 2, self.shape[0])):
+            for y in range(max(cy - 1, 0), min(cy + 2, self.shape[1])):
+                indices.extend(self.cells.get((x, y), []))
+        # Keep the brute-force order so the flocks (and the floating point sums over them) are identical.
+        indices.sort()
+        return indices
+        
         
 class World:
-    def __init__(self, boundaries, boids=None, rng=np.random):
+    def __init__(self, boundaries, boids=None, rng=np.random, spatial_index=True):
         self.boundaries = boundaries
         self.boids = boids 
         self.rng = rng
+        self.grid = SpatialGrid(boundaries) if spatial_index else None
         
     def create_boids(self, number_of_boids:int):
         self.boids = [Boid.random(self.boundaries, self.rng) for _ in range(number_of_boids)]
         
+    def flocks(self) -> list[list[Boid]]:
+        """Returns the flock (the boids it can see) of every boid."""
+        if self.grid is None:
+            # Brute force: O(N^2) distance checks.
+            return [[b2 for b2 in self.boids if b1.can_see(b2)] for b1 in self.boids]
+        
+        self.grid.rebuild(self.boids)
+        return [[self.boids[j] for j in self.grid.candidates(b1.position) if b1.can_see(self.boids[j])]
+                for b1 in self.boids]
+        
     def advance(self):
         # Prepare
-        for b1 in self.boids:
-            flock = [b2 for b2 in self.boids if b1.can_see(b2)]
+        for b1, flock in zip(self.boids, self.flocks()):
             b1.calculate_next_heading(flock, self.rng)
         
         # Execute
@@ -171,6 +231,437 @@ class World:
             yield self.draw()
             self.advance()
         
+
+class VectorWorld:
+    """
+    Same simulation as `World`, but the flock is stored as arrays instead of `Boid` objects:
+    `positions` and `headings` are (N, 2) and `colors` holds indices into `Boid.color_options`.
+    Neighbors come from a cell list (like `SpatialGrid`), and all rules are computed for blocks of boids at once,
+    over the (boid, candidate neighbor) pairs from the 3x3 block of cells around each boid. The random draws happen in the same order as in `World`,
+    so for the same seed both give the same result (up to floating point rounding).
+    """
+    def __init__(self, boundaries, positions=None, headings=None, colors=None, rng=np.random, block_size:int=4096):
+        self.boundaries = np.array(boundaries, dtype=np.float64)
+        self.positions:np.array = positions
+        self.headings:np.array = headings
+        self.colors:np.array = colors
+        self.rng = rng
+        self.block_size = block_size # Boids handled per batch. Memory use is O(block_size * neighbors per boid).
+        
+    @classmethod
+    def from_world(cls, world:World, **kwargs) -> 'VectorWorld':
+        positions = np.array([b.position for b in world.boids], dtype=np.float64)
+        headings = np.array([b.heading for b in world.boids], dtype=np.float64)
+        colors = np.array([Boid.color_options.index(b.color) for b in world.boids], dtype=np.int64)
+        return cls(world.boundaries, positions, headings, colors, rng=world.rng, **kwargs)
+        
+    def create_boids(self, number_of_boids:int):
+        # One boid at a time, like `Boid.random`, so the random stream matches `World.create_boids`.
+        positions, headings, colors = [], [], []
+        for _ in range(number_of_boids):
+            b = Boid.random(self.boundaries, self.rng)
+            positions.append(b.position)
+            headings.append(b.heading)
+            colors.append(Boid.color_options.index(b.color))
+        self.positions = np.array(positions, dtype=np.float64).reshape(-1, 2)
+        self.headings = np.array(headings, dtype=np.float64).reshape(-1, 2)
+        self.colors = np.array(colors, dtype=np.int64)
+        
+    @property
+    def weights(self) -> np.array:
+        return np.array([Boid.r1_weight, Boid.r2_weight, Boid.r3_weight, Boid.r4_weight, Boid.r5_weight])
+        
+    def cell_list(self):
+        """
+        Boid indices sorted by cell (`order`), where cell c's boids are order[cell_start[c]:cell_start[c + 1]],
+        plus the grid it used. Cells are sized from the current `Boid.flock_threshhold`, like `SpatialGrid`.
+        """
+        grid_shape = np.array([max(1, int(b // Boid.flock_threshhold)) for b in self.boundaries], dtype=np.int64)
+        cell_size = self.boundaries / grid_shape
+        cells = np.minimum((self.positions / cell_size).astype(np.int64), grid_shape - 1)
+        cell_ids = cells[:, 0] * grid_shape[1] + cells[:, 1]
+        order = np.argsort(cell_ids, kind="stable")
+        cell_start = np.searchsorted(cell_ids[order], np.arange(grid_shape.prod() + 1))
+        return order, cell_start, grid_shape, cell_size
+        
+    def candidate_pairs(self, start:int, stop:int, cells) -> tuple[np.array, np.array]:
+        """
+        (i, j) index pairs for every boid i in `start:stop` and every boid j in the 3x3 block of cells around it
+        (including i itself). `cells` is the result of `cell_list`.
+        """
+        order, cell_start, grid_shape, cell_size = cells
+        idx = np.arange(start, stop)
+        own_cell = np.minimum((self.positions[idx] / cell_size).astype(np.int64), grid_shape - 1)
+        boids, neighbors = [], []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                x, y = own_cell[:, 0] + dx, own_cell[:, 1] + dy
+                # No wrapping, like `SpatialGrid.candidates`.
+                inside = (x >= 0) & (x < grid_shape[0]) & (y >= 0) & (y < grid_shape[1])
+                cell = x[inside] * grid_shape[1] + y[inside]
+                first, counts = cell_start[cell], cell_start[cell + 1] - cell_start[cell]
+                within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+                boids.append(np.repeat(idx[inside], counts))
+                neighbors.append(order[np.repeat(first, counts) + within])
+        return np.concatenate(boids), np.concatenate(neighbors)
+        
+    def next_headings(self, start:int, stop:int, cells=None) -> np.array:
+        """Applies the five rules to the boids `start:stop`, against the boids in the cells around them."""
+        if cells is None:
+            cells = self.cell_list()
+        i, j = self.candidate_pairs(start, stop, cells)
+        relative_positions = self.positions[j] - self.positions[i]
+        distances = np.linalg.norm(relative_positions, axis=1)
+        
+        visible = (distances <= Boid.flock_threshhold) & (i != j) # A boid isn't part of its own flock.
+        i, j, relative_positions, distances = i[visible], j[visible], relative_positions[visible], distances[visible]
+        row = i - start
+        n = stop - start
+        too_close = distances <= Boid.too_close_threshhold
+        same_color = self.colors[j] == self.colors[i]
+        
+        def total(mask, values):
+            # Sum of `values` over each boid's pairs where `mask` holds.
+            return np.stack([np.bincount(row[mask], weights=values[mask, axis], minlength=n) for axis in range(2)], axis=1)
+        
+        same_color_count = np.bincount(row[same_color], minlength=n)[:, np.newaxis]
+        has_same_color = same_color_count > 0
+        
+        # Rule 1: Separation
+        r1 = -1 * total(too_close, relative_positions)
+        # Rule 2: Alignment
+        r2 = np.where(has_same_color, total(same_color, self.headings[j]) / np.maximum(same_color_count, 1), 0)
+        # Rule 3: Cohesion
+        r3 = np.where(has_same_color, total(same_color, relative_positions) / np.maximum(same_color_count, 1), 0)
+        # Rule 4: Avoid other colors
+        r4 = -1 * total(too_close & ~same_color, relative_positions)
+        # Rule 5: Individualism. `World` only draws for boids that have a flock, in order.
+        has_flock = np.bincount(row, minlength=n) > 0
+        r5 = np.zeros((n, 2))
+        r5[has_flock] = self.rng.normal(size=(has_flock.sum(), 2))
+        
+        w1, w2, w3, w4, w5 = self.weights
+        influence = r1 * w1 + r2 * w2 + r3 * w3 + r4 * w4 + r5 * w5
+        headings = self.headings[start:stop]
+        return np.where(has_flock[:, np.newaxis], headings + influence, headings)
+        
+    def advance(self):
+        # Prepare
+        n = len(self.positions)
+        cells = self.cell_list()
+        next_headings = np.empty_like(self.headings)
+        for start in range(0, n, self.block_size):
+            stop = min(start + self.block_size, n)
+            next_headings[start:stop] = self.next_headings(start, stop, cells)
+            
+        # Execute
+        self.headings = next_headings
+        speed = np.linalg.norm(self.headings, axis=1)[:, np.newaxis]
+        delta = np.where(speed > Boid.top_speed, self.headings / np.where(speed > 0, speed, 1) * Boid.top_speed, self.headings)
+        self.positions = self.positions + delta
+        
+        # Wrap (same repeated add/subtract as `Boid.advance`)
+        for axis in range(2):
+            edge = self.boundaries[axis]
+            column = self.positions[:, axis]
+            while (column > edge).any():
+                column[column > edge] -= edge
+            while (column < 0).any():
+                column[column < 0] += edge
+                
+    def draw(self):
+        plt.xlim([0, self.boundaries[0]])
+        plt.ylim([0, self.boundaries[1]])
+        plt.tight_layout()
+        plt.axis("off")
+        plt.gca().set_aspect("equal")
+        
+        plt.scatter(self.positions[:, 0], self.positions[:, 1], c=np.array(Boid.color_options)[self.colors], s=2)
+        return plt.gcf()
+    
+    def gen_frames(self):
+        while True:
+            yield self.draw()
+            self.advance()
+            
+
+@numba.njit(parallel=True, cache=True)
+def _flock_rules_kernel(positions, headings, colors, order, cell_start, grid_shape, cell_size, flock_threshhold, too_close_threshhold):
+    """
+    Neighbor scan for every boid (in parallel). Returns the unweighted rules 1-4 as a (N, 4, 2) array and whether each boid has a flock.
+    Neighbors are looked up in the cell list given by `order` (boid indices sorted by cell) and `cell_start`.
+    """
+    n = positions.shape[0]
+    rules = np.zeros((n, 4, 2))
+    has_flock = np.zeros(n, dtype=np.bool_)
+    for i in numba.prange(n):
+        px, py = positions[i, 0], positions[i, 1]
+        cx = min(int(px / cell_size[0]), grid_shape[0] - 1)
+        cy = min(int(py / cell_size[1]), grid_shape[1] - 1)
+        same_color_count = 0
+        for x in range(max(cx - 1, 0), min(cx + 2, grid_shape[0])):
+            for y in range(max(cy - 1, 0), min(cy + 2, grid_shape[1])):
+                cell = x * grid_shape[1] + y
+                for k in range(cell_start[cell], cell_start[cell + 1]):
+                    j = order[k]
+                    if j == i:
+                        continue
+                    dx = positions[j, 0] - px
+                    dy = positions[j, 1] - py
+                    distance = math.sqrt(dx * dx + dy * dy)
+                    if distance > flock_threshhold:
+                        continue
+                    has_flock[i] = True
+                    too_close = distance <= too_close_threshhold
+                    same_color = colors[j] == colors[i]
+                    if too_close: # Rule 1: Separation
+                        rules[i, 0, 0] -= dx
+                        rules[i, 0, 1] -= dy
+                    if same_color: # Rules 2 and 3: Alignment and Cohesion (summed here, averaged below)
+                        same_color_count += 1
+                        rules[i, 1, 0] += headings[j, 0]
+                        rules[i, 1, 1] += headings[j, 1]
+                        rules[i, 2, 0] += dx
+                        rules[i, 2, 1] += dy
+                    elif too_close: # Rule 4: Avoid other colors
+                        rules[i, 3, 0] -= dx
+                        rules[i, 3, 1] -= dy
+        if same_color_count > 0:
+            for rule in range(1, 3):
+                rules[i, rule, 0] /= same_color_count
+                rules[i, rule, 1] /= same_color_count
+    return rules, has_flock
+
+
+@numba.njit(parallel=True, cache=True)
+def _execute_kernel(positions, headings, rules, noise, has_flock, weights, top_speed, boundaries):
+    """Updates headings and positions in place (the "Execute" phase of `World.advance`)."""
+    n = positions.shape[0]
+    for i in numba.prange(n):
+        if has_flock[i]:
+            for axis in range(2):
+                influence = (rules[i, 0, axis] * weights[0] + rules[i, 1, axis] * weights[1]
+                             + rules[i, 2, axis] * weights[2] + rules[i, 3, axis] * weights[3]
+                             + noise[i, axis] * weights[4])
+                headings[i, axis] += influence
+        dx, dy = headings[i, 0], headings[i, 1]
+        speed = math.sqrt(dx * dx + dy * dy)
+        if speed > top_speed:
+            dx = dx / speed * top_speed
+            dy = dy / speed * top_speed
+        positions[i, 0] += dx
+        positions[i, 1] += dy
+        for axis in range(2):
+            while positions[i, axis] > boundaries[axis]:
+                positions[i, axis] -= boundaries[axis]
+            while positions[i, axis] < 0:
+                positions[i, axis] += boundaries[axis]
+                
+
+class NumbaWorld(VectorWorld):
+    """
+    `VectorWorld` stepped by numba kernels running on all cores.
+    Neighbors are found through a cell list (like `SpatialGrid`) and the random draws still happen on `rng`,
+    in the same order as `World`, between the prepare and execute phases.
+    """
+    def advance(self):
+        # Prepare
+        order, cell_start, grid_shape, cell_size = self.cell_list()
+        rules, has_flock = _flock_rules_kernel(self.positions, self.headings, self.colors, order, cell_start,
+                                               grid_shape, cell_size, Boid.flock_threshhold,
+                                               Boid.too_close_threshhold)
+        noise = np.zeros_like(self.positions)
+        noise[has_flock] = self.rng.normal(size=(has_flock.sum(), 2))
+        
+        # Execute
+        _execute_kernel(self.positions, self.headings, rules, noise, has_flock, self.weights,
+                        Boid.top_speed, self.boundaries)
+        
+
+def benchmark_threads(number_of_boids:int=20_000, steps:int=20, boundaries=(200, 200), seed:int=0) -> dict[int, float]:
+    """
+    Times `NumbaWorld.advance` with 1 up to all available threads. Returns {threads: seconds per step}.
+    """
+    import time
+    results = {}
+    for threads in range(1, numba.config.NUMBA_NUM_THREADS + 1):
+        numba.set_num_threads(threads)
+        world = NumbaWorld(boundaries, rng=np.random.default_rng(seed))
+        world.create_boids(number_of_boids)
+        world.advance() # compile / warm up
+        start = time.perf_counter()
+        for _ in range(steps):
+            world.advance()
+        results[threads] = (time.perf_counter() - start) / steps
+        print(f"{threads} thread(s): {results[threads]*1000:.1f} ms/step")
+    numba.set_num_threads(numba.config.NUMBA_NUM_THREADS)
+    return results
+
+
+class Rasterizer:
+    """
+    Draws boids straight into a palette-indexed uint8 frame (0 is the background, 1.. are `Boid.color_options`).
+    No matplotlib figure is involved, so it works without a display.
+    """
+    def __init__(self, boundaries, size:tuple[int, int]=(480, 480), dot_size:int=2, background="white"):
+        self.boundaries = np.array(boundaries, dtype=np.float64)
+        self.size = size # (height, width) in pixels
+        self.dot_size = dot_size
+        self.palette = np.array([to_rgb(background)] + [to_rgb(c) for c in Boid.color_options])
+        self.palette = (self.palette * 255).round().astype(np.uint8)
+        
+    def new_frame(self) -> np.array:
+        return np.zeros(self.size, dtype=np.uint8)
+        
+    def draw(self, positions:np.array, colors:np.array, frame:np.array) -> np.array:
+        height, width = self.size
+        xs = (positions[:, 0] / self.boundaries[0] * (width - self.dot_size)).astype(np.int64)
+        ys = ((1 - positions[:, 1] / self.boundaries[1]) * (height - self.dot_size)).astype(np.int64) # y axis points up
+        xs = np.clip(xs, 0, width - self.dot_size)
+        ys = np.clip(ys, 0, height - self.dot_size)
+        frame[:] = 0
+        for dy in range(self.dot_size):
+            for dx in range(self.dot_size):
+                frame[ys + dy, xs + dx] = colors + 1
+        return frame
+    
+    
+# GifSink, RawSink and FFmpegSink are copied in mandelbrot/mandelbrot.py; keep the copies identical.
+class GifSink:
+    """Writes indexed frames to a GIF one at a time (PillowWriter keeps every frame in memory until the end)."""
+    def __init__(self, filename, palette:np.array, fps:int=60):
+        from PIL import Image
+        self.Image = Image
+        self.file = open(filename, "wb")
+        self.palette = np.zeros((256, 3), dtype=np.uint8)
+        self.palette[:len(palette)] = palette
+        self.duration = round(1000 / fps)
+        self.started = False
+        
+    def write(self, frame:np.array) -> None:
+        from PIL import GifImagePlugin
+        image = self.Image.fromarray(frame, mode="P")
+        image.putpalette(self.palette.tobytes())
+        if not self.started:
+            header, _ = GifImagePlugin.getheader(image, None, {"loop": 0, "duration": self.duration})
+            self.file.writelines(header)
+            self.started = True
+        self.file.writelines(GifImagePlugin.getdata(image, duration=self.duration))
+        
+    def close(self) -> None:
+        self.file.write(b";") # GIF trailer
+        self.file.close()
+        
+        
+class RawSink:
+    """Appends every frame as raw rgb24 bytes (read back with `np.fromfile(...).reshape(-1, height, width, 3)`)."""
+    def __init__(self, filename, palette:np.array):
+        self.file = open(filename, "wb")
+        self.palette = palette
+        
+    def write(self, frame:np.array) -> None:
+        self.file.write(self.palette[frame].tobytes())
+        
+    def close(self) -> None:
+        self.file.close()
+        
+        
+class FFmpegSink(RawSink):
+    """Pipes rgb24 frames into an ffmpeg process (needs `ffmpeg` on the PATH)."""
+    def __init__(self, filename, palette:np.array, size:tuple[int, int], fps:int=60):
+        import subprocess
+        height, width = size
+        self.process = subprocess.Popen(
+            ["ffmpeg", "-y", "-loglevel", "error",
+             "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", str(fps), "-i", "-",
+             "-pix_fmt", "yuv420p", "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", str(filename)],
+            stdin=subprocess.PIPE)
+        self.file = self.process.stdin
+        self.palette = palette
+        
+    def close(self) -> None:
+        self.file.close()
+        if self.process.wait() != 0:
+            raise RuntimeError(f"ffmpeg exited with code {self.process.returncode}.")
+        
+        
+class FrameWriter:
+    """
+    Hands frames to a sink on a background thread, so the simulation keeps running while frames are encoded.
+    Frames come from a small pool of reused buffers: `acquire` one, draw into it, `submit` it.
+    """
+    def __init__(self, sink, new_frame:Callable[[], np.array], buffers:int=4):
+        self.sink = sink
+        self.free = queue.Queue()
+        self.filled = queue.Queue()
+        for _ in range(buffers):
+            self.free.put(new_frame())
+        self.error:Optional[BaseException] = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        
+    def _run(self) -> None:
+        while True:
+            frame = self.filled.get()
+            if frame is None:
+                return
+            try:
+                if self.error is None:
+                    self.sink.write(frame)
+            except BaseException as e:
+                self.error = e
+            self.free.put(frame)
+            
+    def _check(self) -> None:
+        if self.error is not None:
+            raise RuntimeError("Writing a frame failed.") from self.error
+        
+    def acquire(self) -> np.array:
+        self._check()
+        return self.free.get() # Blocks while the writer is behind.
+    
+    def submit(self, frame:np.array) -> None:
+        self.filled.put(frame)
+        
+    def close(self) -> None:
+        self.filled.put(None)
+        self.thread.join()
+        self.sink.close()
+        self._check()
+        
+        
+def export_frames(world, filename, frames:int, size:tuple[int, int]=(480, 480), fps:int=60, dot_size:int=2, progress=True) -> None:
+    """
+    Runs `world` (a `World` or `VectorWorld`) for `frames` frames and streams them to `filename` without pyplot.
+    The format depends on the extension: .gif, .mp4 (through ffmpeg) or anything else for raw rgb24 frames.
+    """
+    import os
+    from tqdm import trange
+    
+    rasterizer = Rasterizer(world.boundaries, size=size, dot_size=dot_size)
+    extension = os.path.splitext(str(filename))[1].lower()
+    if extension == ".gif":
+        sink = GifSink(filename, rasterizer.palette, fps=fps)
+    elif extension == ".mp4":
+        sink = FFmpegSink(filename, rasterizer.palette, size=size, fps=fps)
+    else:
+        sink = RawSink(filename, rasterizer.palette)
+    
+    writer = FrameWriter(sink, rasterizer.new_frame)
+    try:
+        for _ in (trange(frames) if progress else range(frames)):
+            if isinstance(world, VectorWorld):
+                positions, colors = world.positions, world.colors
+            else:
+                positions = np.array([b.position for b in world.boids])
+                colors = np.array([Boid.color_options.index(b.color) for b in world.boids])
+            frame = writer.acquire()
+            rasterizer.draw(positions, colors, frame)
+            writer.submit(frame)
+            world.advance()
+    finally:
+        writer.close()
+
         
 def main():
     SEED = np.random.randint(1E6, 1E7)
@@ -3,7 +3,11 @@
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
-from typing import Any, Callable, Union
+import json
+import os
+import weakref
+from collections import OrderedDict, deque
+from typing import Any, Callable, Optional, Union
 from matplotlib.image import AxesImage #only for typing
 
 
@@ -32,9 +36,46 @@ def matrix_neighbors(board:np.array) -> np.array:
     #         yield padded[y:y_lim-y, x:x_lim-x]
     
 
-def next_life_generation(board:np.array, max_iterations=int):
+class CycleDetector:
+    """
+    Remembers hashes of the last `window` generations and notices when a board repeats one of them.
+    After that, `period` is the length of the cycle (1 for a still life or a dead board) and `first_repeat`
+    is the generation that repeated an earlier one, so the cycle starts at `first_repeat - period`.
+    """
+    def __init__(self, window:int=64):
+        self.window = window
+        self.hashes:dict[int, int] = {} # hash -> generation
+        self.order:deque = deque()
+        self.generation = 0
+        self.period:Optional[int] = None
+        self.first_repeat:Optional[int] = None
+        
+    @property
+    def cycle_start(self) -> Optional[int]:
+        return None if self.period is None else self.first_repeat - self.period
+        
+    def update(self, board:np.array) -> bool:
+        """Registers the next generation. Returns True once a cycle was found."""
+        if self.period is not None:
+            return True
+        key = hash(np.packbits(board).tobytes())
+        if key in self.hashes:
+            self.period = self.generation - self.hashes[key]
+            self.first_repeat = self.generation
+            return True
+        self.hashes[key] = self.generation
+        self.order.append(key)
+        if len(self.order) > self.window:
+            del self.hashes[self.order.popleft()]
+        self.generation += 1
+        return False
+
+
+def next_life_generation(board:np.array, max_iterations=int, detector:Optional[CycleDetector]=None, stop_on_cycle=False):
     for _ in range(max_iterations-1):
         yield board
+        if detector is not None and detector.update(board) and stop_on_cycle:
+            break
         neighbor_matrix = np.zeros(board.shape, dtype=np.uint8)
         for neighbor in matrix_neighbors(board):
             neighbor_matrix += neighbor
@@ -45,6 +86,653 @@ def next_life_generation(board:np.array, max_iterations=int):
         #     # all cells are dead
         #     break
 
+class BatchLife:
+    """
+    Steps a (B, H, W) stack of independent boards together, with the rule and dead border of `next_life_generation`.
+    Instead of keeping frames it records, per board, the population each generation and when it settled into a cycle.
+    Boards that settled are dropped from the stack, so the rest of the run only pays for the ones still changing.
+    """
+    def __init__(self, boards:np.array, window:int=16, seed:int=0):
+        self.boards = boards.astype(bool)
+        self.window = window
+        n = len(boards)
+        self.generation = 0
+        self.running = np.arange(n) # indices of the boards still being stepped
+        self.stabilized_at = np.full(n, -1, dtype=np.int64) # first generation of the cycle, -1 if it never settled
+        self.period = np.zeros(n, dtype=np.int64)
+        self.final_population = self.boards.sum(axis=(1, 2))
+        self.populations = [self.final_population.copy()] # one (B,) array per generation, -1 once a board stopped
+        
+        # Hash of a board: its packed bytes times random 64-bit weights, summed (wrapping).
+        n_bytes = -(-boards.shape[1] * boards.shape[2] // 8)
+        self._weights = np.random.default_rng(seed).integers(1, 2**63, size=n_bytes, dtype=np.uint64) | np.uint64(1)
+        self._history = np.zeros((n, window), dtype=np.uint64) # ring buffer of the last `window` hashes
+        self._history_generation = np.full(window, -1, dtype=np.int64)
+        self._record_hashes()
+        
+    def _hashes(self) -> np.array:
+        packed = np.packbits(self.boards.reshape(len(self.boards), -1), axis=1).astype(np.uint64)
+        return (packed * self._weights).sum(axis=1)
+    
+    def _record_hashes(self) -> None:
+        hashes = self._hashes()
+        slot = self.generation % self.window
+        seen = (self._history[self.running] == hashes[:, np.newaxis]) & (self._history_generation >= 0)
+        settled = seen.any(axis=1)
+        if settled.any():
+            idx = self.running[settled]
+            matched_generation = self._history_generation[seen[settled].argmax(axis=1)]
+            self.period[idx] = self.generation - matched_generation
+            self.stabilized_at[idx] = matched_generation
+            keep = ~settled
+            self.running = self.running[keep]
+            self.boards = self.boards[keep]
+            hashes = hashes[keep]
+        self._history[self.running, slot] = hashes
+        self._history_generation[slot] = self.generation
+        
+    def step(self) -> None:
+        padded = np.pad(self.boards, ((0, 0), (1, 1), (1, 1)))
+        h, w = self.boards.shape[1:]
+        neighbors = np.zeros(self.boards.shape, dtype=np.uint8)
+        for dy in range(3):
+            for dx in range(3):
+                if dy != 1 or dx != 1:
+                    neighbors += padded[:, dy:dy+h, dx:dx+w]
+        self.boards = np.logical_or(neighbors == 3, np.logical_and(self.boards, neighbors == 2))
+        self.generation += 1
+        
+        population = self.boards.sum(axis=(1, 2))
+        self.final_population[self.running] = population
+        populations = np.full(len(self.final_population), -1, dtype=np.int64)
+        populations[self.running] = population
+        self.populations.append(populations)
+        self._record_hashes()
+        
+    def run(self, max_generations:int) -> 'BatchLife':
+        while self.generation < max_generations and len(self.running):
+            self.step()
+        return self
+    
+    
+def random_boards(seeds, cutoffs, size=(150, 150)) -> np.array:
+    """One board per (seed, cutoff) pair, made the same way as in `main`."""
+    return np.stack([np.random.default_rng(seed).random(size) > cutoff for seed, cutoff in zip(seeds, cutoffs)])
+
+
+_BYTE_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, np.newaxis], axis=1).sum(axis=1).astype(np.uint8)
+
+
+class PackedBoard:
+    """
+    Board stored as bits: each row is packed into uint64 words, 64 cells per word (bit j of word k is column 64*k + j).
+    Uses 8x less memory than the bool board, and a generation is computed with bitwise adder logic on whole words.
+    Follows the same rule and the same dead border as `next_life_generation`.
+    """
+    def __init__(self, words:np.array, width:int):
+        self.words = words # (height, ceil(width / 64)) uint64
+        self.width = width
+        self._spare = None # the other buffer `step` writes into
+        
+    @classmethod
+    def from_board(cls, board:np.array) -> 'PackedBoard':
+        height, width = board.shape
+        n_words = -(-width // 64)
+        padded = np.zeros((height, n_words * 64), dtype=bool)
+        padded[:, :width] = board
+        words = np.packbits(padded, axis=1, bitorder="little").view("<u8")
+        return cls(np.ascontiguousarray(words, dtype=np.uint64), width)
+    
+    def to_board(self) -> np.array:
+        bits = np.unpackbits(self.words.astype("<u8").view(np.uint8), axis=1, bitorder="little")
+        return bits[:, :self.width].astype(bool)
+    
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.words.shape[0], self.width
+    
+    def population(self) -> int:
+        # Bits set per byte, looked up from a 256-entry table.
+        return int(_BYTE_POPCOUNT[self.words.view(np.uint8)].sum(dtype=np.int64))
+    
+    def _west(self, words:np.array) -> np.array:
+        # Neighbor at column c-1, moved into column c.
+        shifted = words << np.uint64(1)
+        shifted[:, 1:] |= words[:, :-1] >> np.uint64(63)
+        return shifted
+    
+    def _east(self, words:np.array) -> np.array:
+        # Neighbor at column c+1, moved into column c.
+        shifted = words >> np.uint64(1)
+        shifted[:, :-1] |= words[:, 1:] << np.uint64(63)
+        return shifted
+    
+    def step(self, band_rows:int=256) -> 'PackedBoard':
+        """
+        Advances one generation in place. The board is processed `band_rows` rows at a time into a second word array,
+        so a step needs the two packed boards plus scratch the size of one band, not of the whole board.
+        """
+        cells = self.words
+        height, n_words = cells.shape
+        if self._spare is None or self._spare.shape != cells.shape:
+            self._spare = np.empty_like(cells)
+        result = self._spare
+        for top in range(0, height, band_rows):
+            bottom = min(top + band_rows, height)
+            # The band plus one row above and below, with a dead row past the edges.
+            band = np.zeros((bottom - top + 2, n_words), dtype=np.uint64)
+            band[max(1 - top, 0):bottom - top + 1 + (bottom < height)] = cells[max(top - 1, 0):bottom + 1]
+            self._step_band(band, result[top:bottom])
+        self.words, self._spare = result, cells
+        self._clear_padding()
+        return self
+    
+    def _step_band(self, band:np.array, out:np.array) -> None:
+        # Next generation of band[1:-1] into `out`; band[0] and band[-1] are only neighbors.
+        west, east = self._west(band), self._east(band)
+        
+        # Per row: west + east (half adder) and west + centre + east (full adder).
+        row2_ones = west ^ east
+        row2_twos = west & east
+        row3_ones = row2_ones ^ band
+        row3_twos = row2_twos | (row2_ones & band)
+        
+        # The rows above and below.
+        up_ones, up_twos = row3_ones[:-2], row3_twos[:-2]
+        down_ones, down_twos = row3_ones[2:], row3_twos[2:]
+        row2_ones, row2_twos, cells = row2_ones[1:-1], row2_twos[1:-1], band[1:-1]
+        
+        # Ones: up + middle + down (full adder), carrying into the twos.
+        ones = up_ones ^ row2_ones ^ down_ones
+        carry = (up_ones & row2_ones) | (down_ones & (up_ones ^ row2_ones))
+        # Twos: up + middle + down + carry, anything past that is 4 or more neighbors.
+        twos_partial = up_twos ^ row2_twos ^ down_twos
+        fours = (up_twos & row2_twos) | (down_twos & (up_twos ^ row2_twos)) | (twos_partial & carry)
+        twos = twos_partial ^ carry
+        
+        # 2 or 3 neighbors and alive, or exactly 3 neighbors.
+        np.bitwise_and(twos & ~fours, ones | cells, out=out)
+    
+    def _clear_padding(self) -> None:
+        unused = self.words.shape[1] * 64 - self.width
+        if unused:
+            self.words[:, -1] &= np.uint64((1 << (64 - unused)) - 1)
+            
+            
+def next_packed_life_generation(board:np.array, max_iterations=int):
+    """Same generations as `next_life_generation`, computed on a `PackedBoard`."""
+    packed = PackedBoard.from_board(board)
+    for _ in range(max_iterations-1):
+        yield packed.to_board()
+        packed.step()
+
+
+class SparseLife:
+    """
+    Steps only the tiles that can change: the ones where something changed last generation, and their neighbors.
+    The cost of a generation depends on how much is happening, not on the size of the board.
+    Same rule and dead border as `next_life_generation`.
+    """
+    def __init__(self, board:np.array, tile_size:int=32):
+        self.shape = board.shape
+        self.tile_size = t = tile_size
+        self.tiles = (-(-board.shape[0] // t), -(-board.shape[1] // t))
+        # The board with a dead border of 1 cell, rounded up to whole tiles.
+        self.padded = np.zeros((self.tiles[0] * t + 2, self.tiles[1] * t + 2), dtype=bool)
+        self.padded[1:board.shape[0]+1, 1:board.shape[1]+1] = board
+        inside = np.zeros_like(self.padded)
+        inside[1:board.shape[0]+1, 1:board.shape[1]+1] = True
+        self.inside = self._tile_view(inside, halo=False)
+        self.active = np.ones(self.tiles, dtype=bool)
+        self.generation = 0
+        
+    @property
+    def board(self) -> np.array:
+        return self.padded[1:self.shape[0]+1, 1:self.shape[1]+1]
+    
+    def _tile_view(self, padded:np.array, halo:bool) -> np.array:
+        """(tiles_y, tiles_x, t, t) view of the tiles, or (tiles_y, tiles_x, t+2, t+2) including their 1-cell halos."""
+        t = self.tile_size
+        size = t + 2 if halo else t
+        start = padded if halo else padded[1:, 1:]
+        s0, s1 = padded.strides
+        return np.lib.stride_tricks.as_strided(start, shape=(*self.tiles, size, size), strides=(t*s0, t*s1, s0, s1),
+                                               writeable=not halo)
+    
+    def step(self) -> int:
+        """Advances one generation. Returns the number of tiles that changed."""
+        ty, tx = np.nonzero(self.active)
+        blocks = self._tile_view(self.padded, halo=True)[ty, tx] # (K, t+2, t+2) copies
+        old = blocks[:, 1:-1, 1:-1]
+        
+        neighbors = np.zeros(old.shape, dtype=np.uint8)
+        for dy in range(3):
+            for dx in range(3):
+                if dy != 1 or dx != 1:
+                    neighbors += blocks[:, dy:dy+old.shape[1], dx:dx+old.shape[2]]
+        new = np.logical_or(neighbors == 3, np.logical_and(old, neighbors == 2))
+        new &= self.inside[ty, tx] # Nothing is born past the edge of the board.
+        
+        changed = (new != old).any(axis=(1, 2))
+        self._tile_view(self.padded, halo=False)[ty[changed], tx[changed]] = new[changed]
+        
+        # Next generation: the changed tiles and their 8 neighbors.
+        changed_tiles = np.zeros((self.tiles[0] + 2, self.tiles[1] + 2), dtype=bool)
+        changed_tiles[ty[changed] + 1, tx[changed] + 1] = True
+        self.active = np.zeros(self.tiles, dtype=bool)
+        for dy in range(3):
+            for dx in range(3):
+                self.active |= changed_tiles[dy:dy+self.tiles[0], dx:dx+self.tiles[1]]
+        self.generation += 1
+        return int(changed.sum())
+    
+    
+def next_sparse_life_generation(board:np.array, max_iterations=int, tile_size:int=32):
+    """
+    Same generations as `next_life_generation`, computed with `SparseLife`.
+    Stops early once the board doesn't change anymore (a still life, or every cell dead).
+    The yielded board is updated in place, so copy it to keep it.
+    """
+    life = SparseLife(board, tile_size=tile_size)
+    for _ in range(max_iterations-1):
+        yield life.board
+        if life.step() == 0:
+            break
+
+
+def _mapped_state(directory:str, shape:tuple[int, int], tile_size:int, shm_name:str) -> dict:
+    """Memmaps and shared-memory views the `_mapped_*` functions work on, opened in the process that uses them."""
+    from multiprocessing import shared_memory
+    height, width = shape
+    tiles = (-(-height // tile_size), -(-width // tile_size))
+    shm = shared_memory.SharedMemory(name=shm_name)
+    rows_size = 2 * tiles[0] * 2 * width
+    return dict(
+        boards=[np.load(os.path.join(directory, f"board_{i}.npy"), mmap_mode="r+") for i in range(2)],
+        shm=shm,
+        # Edge rows and columns of every tile band, for both buffers: rows[buffer, tile_y, top/bottom, x]
+        rows=np.ndarray((2, tiles[0], 2, width), dtype=np.uint8, buffer=shm.buf),
+        cols=np.ndarray((2, tiles[1], 2, height), dtype=np.uint8, buffer=shm.buf, offset=rows_size),
+        tile_size=tile_size,
+        tiles=tiles,
+    )
+
+
+# State of a `MappedLife` pool worker process, set by `_mapped_worker_init`. Without a pool, the state lives on the instance.
+_mapped_worker = {}
+
+
+def _mapped_worker_init(*args) -> None:
+    _mapped_worker.update(_mapped_state(*args))
+    
+    
+def _mapped_in_worker(function, *args):
+    return function(_mapped_worker, *args)
+    
+    
+def _mapped_tile_bounds(state:dict, ty:int, tx:int) -> tuple[int, int, int, int]:
+    t = state["tile_size"]
+    height, width = state["boards"][0].shape
+    return ty * t, min((ty + 1) * t, height), tx * t, min((tx + 1) * t, width)
+
+
+def _mapped_write_edges(state:dict, tile:np.array, ty:int, tx:int, buffer:int) -> None:
+    y0, y1, x0, x1 = _mapped_tile_bounds(state, ty, tx)
+    state["rows"][buffer, ty, 0, x0:x1] = tile[0]
+    state["rows"][buffer, ty, 1, x0:x1] = tile[-1]
+    state["cols"][buffer, tx, 0, y0:y1] = tile[:, 0]
+    state["cols"][buffer, tx, 1, y0:y1] = tile[:, -1]
+    
+    
+def _mapped_extract_edges(state:dict, ty:int, tx:int, buffer:int) -> None:
+    y0, y1, x0, x1 = _mapped_tile_bounds(state, ty, tx)
+    _mapped_write_edges(state, np.asarray(state["boards"][buffer][y0:y1, x0:x1]), ty, tx, buffer)
+
+
+def _mapped_step_tile(state:dict, ty:int, tx:int, source:int) -> int:
+    """Steps one tile from buffer `source` into the other one. Returns the tile's new population."""
+    y0, y1, x0, x1 = _mapped_tile_bounds(state, ty, tx)
+    tiles_y, tiles_x = state["tiles"]
+    rows, cols = state["rows"][source], state["cols"][source]
+    height, width = state["boards"][0].shape
+    
+    # The tile with a 1-cell halo taken from the neighbors' edges (dead past the edge of the board).
+    padded = np.zeros((y1 - y0 + 2, x1 - x0 + 2), dtype=np.uint8)
+    padded[1:-1, 1:-1] = state["boards"][source][y0:y1, x0:x1]
+    if tx > 0:
+        padded[1:-1, 0] = cols[tx - 1, 1, y0:y1]
+    if tx < tiles_x - 1:
+        padded[1:-1, -1] = cols[tx + 1, 0, y0:y1]
+    halo_x0, halo_x1 = max(x0 - 1, 0), min(x1 + 1, width)
+    if ty > 0:
+        padded[0, halo_x0 - x0 + 1:halo_x1 - x0 + 1] = rows[ty - 1, 1, halo_x0:halo_x1]
+    if ty < tiles_y - 1:
+        padded[-1, halo_x0 - x0 + 1:halo_x1 - x0 + 1] = rows[ty + 1, 0, halo_x0:halo_x1]
+    
+    h, w = y1 - y0, x1 - x0
+    neighbors = np.zeros((h, w), dtype=np.uint8)
+    for dy in range(3):
+        for dx in range(3):
+            if dy != 1 or dx != 1:
+                neighbors += padded[dy:dy+h, dx:dx+w]
+    tile = np.logical_or(neighbors == 3, np.logical_and(padded[1:-1, 1:-1], neighbors == 2)).view(np.uint8)
+    
+    state["boards"][1 - source][y0:y1, x0:x1] = tile
+    _mapped_write_edges(state, tile, ty, tx, 1 - source)
+    return int(tile.sum())
+
+
+class MappedLife:
+    """
+    Board kept in memory-mapped files in `directory`, so it can be bigger than RAM.
+    The board is split into tiles that worker processes step in parallel, reading from one file and writing to the other.
+    The tiles' edge rows and columns are swapped through shared memory, so a worker only ever loads its own tile.
+    `meta.json` records which file holds which generation, so a run can be resumed with `MappedLife(directory)`.
+    Same rule and dead border as `next_life_generation`.
+    """
+    def __init__(self, directory, processes:Optional[int]=None):
+        from multiprocessing import shared_memory
+        self.directory = str(directory)
+        with open(os.path.join(self.directory, "meta.json")) as f:
+            meta = json.load(f)
+        self.shape = tuple(meta["shape"])
+        self.tile_size = meta["tile_size"]
+        self.generation = meta["generation"]
+        self.current = meta["current"] # which of board_0.npy / board_1.npy holds `generation`
+        self.tiles = (-(-self.shape[0] // self.tile_size), -(-self.shape[1] // self.tile_size))
+        self.processes = os.cpu_count() if processes is None else processes
+        
+        size = 2 * self.tiles[0] * 2 * self.shape[1] + 2 * self.tiles[1] * 2 * self.shape[0]
+        self._shm = shared_memory.SharedMemory(create=True, size=size)
+        init_args = (self.directory, self.shape, self.tile_size, self._shm.name)
+        if self.processes > 1:
+            import multiprocessing
+            self._pool = multiprocessing.Pool(self.processes, initializer=_mapped_worker_init, initargs=init_args)
+            self._state = None
+        else:
+            self._pool = None
+            self._state = _mapped_state(*init_args)
+        self._map(_mapped_extract_edges, [(ty, tx, self.current) for ty, tx in np.ndindex(*self.tiles)])
+        
+    @classmethod
+    def create(cls, directory, board:Optional[np.array]=None, shape:Optional[tuple[int, int]]=None,
+               tile_size:int=2048, **kwargs) -> 'MappedLife':
+        """
+        Starts a new run in `directory` from `board`, or from an empty board of `shape`.
+        `board` may itself be a memmap; it is copied one tile band at a time.
+        """
+        shape = board.shape if board is not None else tuple(shape)
+        os.makedirs(directory, exist_ok=True)
+        for i in range(2):
+            mapped = np.lib.format.open_memmap(os.path.join(directory, f"board_{i}.npy"), mode="w+",
+                                               dtype=np.uint8, shape=shape)
+            if board is not None and i == 0:
+                for y in range(0, shape[0], tile_size):
+                    mapped[y:y+tile_size] = board[y:y+tile_size]
+            mapped.flush()
+            del mapped
+        cls._write_meta(directory, {"shape": list(shape), "tile_size": tile_size, "generation": 0, "current": 0})
+        return cls(directory, **kwargs)
+    
+    @classmethod
+    def random(cls, directory, shape:tuple[int, int], cutoff:float=.5, seed:Optional[int]=None,
+               tile_size:int=2048, **kwargs) -> 'MappedLife':
+        """New run from a random board, generated one tile band at a time (each band gets its own spawned stream)."""
+        life = cls.create(directory, shape=shape, tile_size=tile_size, processes=1)
+        board = np.load(os.path.join(directory, "board_0.npy"), mmap_mode="r+")
+        streams = np.random.SeedSequence(seed).spawn(life.tiles[0])
+        for ty, stream in enumerate(streams):
+            y0 = ty * tile_size
+            band = board[y0:y0+tile_size]
+            band[:] = np.random.default_rng(stream).random(band.shape) > cutoff
+        board.flush()
+        del board
+        life.close()
+        return cls(directory, **kwargs)
+    
+    @staticmethod
+    def _write_meta(directory, meta:dict) -> None:
+        # Write then rename, so a crash never leaves a half-written checkpoint.
+        path = os.path.join(directory, "meta.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(path + ".tmp", path)
+        
+    def _map(self, function, tasks:list) -> list:
+        if self._pool is None:
+            return [function(self._state, *task) for task in tasks]
+        return self._pool.starmap(_mapped_in_worker, [(function, *task) for task in tasks])
+    
+    @property
+    def board(self) -> np.array:
+        """Read-only memmap of the current generation."""
+        return np.load(os.path.join(self.directory, f"board_{self.current}.npy"), mmap_mode="r")
+    
+    def step(self, generations:int=1) -> int:
+        """
+        Advances `generations` generations. Returns the population of the last one.
+        Every generation is checkpointed: the next one is written into the other file, so the checkpointed file is
+        never touched until a newer generation has replaced it in `meta.json`.
+        """
+        population = None
+        for _ in range(generations):
+            populations = self._map(_mapped_step_tile, [(ty, tx, self.current) for ty, tx in np.ndindex(*self.tiles)])
+            population = sum(populations)
+            self.current = 1 - self.current
+            self.generation += 1
+            self.checkpoint()
+        return population
+    
+    def checkpoint(self) -> None:
+        """Makes sure the current generation is on disk, then records it in `meta.json`."""
+        mapped = np.load(os.path.join(self.directory, f"board_{self.current}.npy"), mmap_mode="r+")
+        mapped.flush()
+        del mapped
+        self._write_meta(self.directory, {"shape": list(self.shape), "tile_size": self.tile_size,
+                                          "generation": self.generation, "current": self.current})
+        
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+        else:
+            self._state = None # drops the worker's memmaps and shared-memory views
+        self._shm.close()
+        self._shm.unlink()
+        
+    def __enter__(self) -> 'MappedLife':
+        return self
+    
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class QuadNode:
+    """
+    Square of 2**level cells, split into four quadrants of 2**(level-1) cells. Level 0 nodes are single cells.
+    Nodes are hash-consed by `HashLife`, so two equal squares are the same object.
+    """
+    __slots__ = ("level", "nw", "ne", "sw", "se", "population", "__weakref__")
+    
+    def __init__(self, level:int, nw=None, ne=None, sw=None, se=None, population:int=0):
+        self.level = level
+        self.nw, self.ne, self.sw, self.se = nw, ne, sw, se
+        self.population = population
+        
+        
+_DEAD = QuadNode(0, population=0)
+_ALIVE = QuadNode(0, population=1)
+
+
+class HashLife:
+    """
+    HashLife (memoized quadtree) engine, for jumping a pattern far ahead.
+    Unlike `next_life_generation`, the board is treated as part of an infinite empty plane, so patterns can leave
+    the original window (and aren't cut off by its edges). `to_board` looks at any window of the plane, by default
+    the one the board started in.
+    """
+    def __init__(self, board:np.array, cache_size:int=1_000_000):
+        self.shape = board.shape
+        self.cache_size = cache_size
+        self._nodes = weakref.WeakValueDictionary() # (nw, ne, sw, se) -> canonical node
+        self._empty = [_DEAD]
+        self._results:OrderedDict = OrderedDict() # (node, j) -> centre advanced 2**j generations, LRU order
+        self.generation = 0
+        
+        level = max(2, int(np.ceil(np.log2(max(board.shape)))))
+        padded = np.zeros((2**level, 2**level), dtype=bool)
+        padded[:board.shape[0], :board.shape[1]] = board
+        self.root = self._from_array(padded)
+        self.origin = (0, 0) # board coordinates (row, column) of the root's top-left cell
+        
+    # Building nodes
+    def join(self, nw:QuadNode, ne:QuadNode, sw:QuadNode, se:QuadNode) -> QuadNode:
+        key = (nw, ne, sw, se)
+        node = self._nodes.get(key)
+        if node is None:
+            node = QuadNode(nw.level + 1, nw, ne, sw, se, nw.population + ne.population + sw.population + se.population)
+            self._nodes[key] = node
+        return node
+    
+    def empty(self, level:int) -> QuadNode:
+        while len(self._empty) <= level:
+            e = self._empty[-1]
+            self._empty.append(self.join(e, e, e, e))
+        return self._empty[level]
+    
+    def _from_array(self, cells:np.array) -> QuadNode:
+        size = cells.shape[0]
+        if size == 1:
+            return _ALIVE if cells[0, 0] else _DEAD
+        if not cells.any():
+            return self.empty(int(np.log2(size)))
+        h = size // 2
+        return self.join(self._from_array(cells[:h, :h]), self._from_array(cells[:h, h:]),
+                         self._from_array(cells[h:, :h]), self._from_array(cells[h:, h:]))
+    
+    def _expand(self, node:QuadNode) -> QuadNode:
+        """The same pattern, centred in a node one level up."""
+        e = self.empty(node.level - 1)
+        return self.join(self.join(e, e, e, node.nw), self.join(e, e, node.ne, e),
+                         self.join(e, node.sw, e, e), self.join(node.se, e, e, e))
+    
+    def _centre(self, node:QuadNode) -> QuadNode:
+        return self.join(node.nw.se, node.ne.sw, node.sw.ne, node.se.nw)
+    
+    def _is_centred(self, node:QuadNode) -> bool:
+        """True if all live cells are in the centre half of the node."""
+        return node.population == self._centre(node).population
+    
+    # Stepping
+    def _life_4x4(self, node:QuadNode) -> QuadNode:
+        """The centre 2x2 of a 4x4 node, one generation later."""
+        cells = [[0] * 4 for _ in range(4)]
+        for qy, qx, quadrant in ((0, 0, node.nw), (0, 2, node.ne), (2, 0, node.sw), (2, 2, node.se)):
+            for y, x, cell in ((0, 0, quadrant.nw), (0, 1, quadrant.ne), (1, 0, quadrant.sw), (1, 1, quadrant.se)):
+                cells[qy + y][qx + x] = cell.population
+        result = []
+        for y in (1, 2):
+            for x in (1, 2):
+                neighbors = sum(cells[y + dy][x + dx] for dy in (-1, 0, 1) for dx in (-1, 0, 1)) - cells[y][x]
+                alive = neighbors == 3 or (cells[y][x] and neighbors == 2)
+                result.append(_ALIVE if alive else _DEAD)
+        return self.join(*result)
+    
+    def _successor(self, node:QuadNode, j:int) -> QuadNode:
+        """The centre of `node` (one level down), 2**j generations later. Needs j <= node.level - 2."""
+        if node.population == 0:
+            return node.nw
+        key = (node, j)
+        result = self._results.get(key)
+        if result is not None:
+            self._results.move_to_end(key)
+            return result
+        
+        if node.level == 2:
+            result = self._life_4x4(node)
+        else:
+            nw, ne, sw, se = node.nw, node.ne, node.sw, node.se
+            # The 9 overlapping sub-squares one level down.
+            n00 = nw
+            n01 = self.join(nw.ne, ne.nw, nw.se, ne.sw)
+            n02 = ne
+            n10 = self.join(nw.sw, nw.se, sw.nw, sw.ne)
+            n11 = self._centre(node)
+            n12 = self.join(ne.sw, ne.se, se.nw, se.ne)
+            n20 = sw
+            n21 = self.join(sw.ne, se.nw, sw.se, se.sw)
+            n22 = se
+            if j == node.level - 2:
+                # Two half steps: 2**(j-1) generations on the 9 squares, then 2**(j-1) more on the 4 combined ones.
+                r = [self._successor(n, j - 1) for n in (n00, n01, n02, n10, n11, n12, n20, n21, n22)]
+                step = lambda a, b, c, d: self._successor(self.join(a, b, c, d), j - 1)
+            else:
+                # The whole step happens on the 9 squares, the combined ones are only re-centred.
+                r = [self._successor(n, j) for n in (n00, n01, n02, n10, n11, n12, n20, n21, n22)]
+                step = lambda a, b, c, d: self._centre(self.join(a, b, c, d))
+            result = self.join(step(r[0], r[1], r[3], r[4]), step(r[1], r[2], r[4], r[5]),
+                               step(r[3], r[4], r[6], r[7]), step(r[4], r[5], r[7], r[8]))
+        
+        self._results[key] = result
+        if len(self._results) > self.cache_size:
+            self._results.popitem(last=False)
+        return result
+    
+    def advance(self, k:int) -> 'HashLife':
+        """Advances 2**k generations."""
+        root, (row, col) = self.root, self.origin
+        while root.level < k + 2 or not self._is_centred(root):
+            row, col = row - 2**(root.level - 1), col - 2**(root.level - 1)
+            root = self._expand(root)
+        # One more level, so the pattern can't grow out of the centre in 2**k generations.
+        row, col = row - 2**(root.level - 1), col - 2**(root.level - 1)
+        root = self._expand(root)
+        
+        self.root = self._successor(root, k)
+        self.origin = (row + 2**(root.level - 2), col + 2**(root.level - 2))
+        self.generation += 2**k
+        return self
+    
+    def step(self, generations:int) -> 'HashLife':
+        """Advances any number of generations, as a sum of powers of two."""
+        k = 0
+        while generations:
+            if generations & 1:
+                self.advance(k)
+            generations >>= 1
+            k += 1
+        return self
+    
+    @property
+    def population(self) -> int:
+        return self.root.population
+    
+    def to_board(self, shape:tuple[int, int]=None, offset:tuple[int, int]=(0, 0)) -> np.array:
+        """The window of the plane starting at `offset` (row, column), by default the original board."""
+        shape = self.shape if shape is None else shape
+        board = np.zeros(shape, dtype=bool)
+        self._fill(board, self.root, self.origin[0] - offset[0], self.origin[1] - offset[1])
+        return board
+    
+    def _fill(self, board:np.array, node:QuadNode, row:int, col:int) -> None:
+        size = 2**node.level
+        if node.population == 0 or row >= board.shape[0] or col >= board.shape[1] or row + size <= 0 or col + size <= 0:
+            return
+        if node.level == 0:
+            board[row, col] = True
+            return
+        h = size // 2
+        self._fill(board, node.nw, row, col)
+        self._fill(board, node.ne, row, col + h)
+        self._fill(board, node.sw, row + h, col)
+        self._fill(board, node.se, row + h, col + h)
+        
+        
+def hashlife_advance(board:np.array, k:int, cache_size:int=1_000_000) -> np.array:
+    """`board` after 2**k generations on an infinite plane, seen through the same window."""
+    return HashLife(board, cache_size=cache_size).advance(k).to_board()
+
+
 def show_board(board:np.array):
     plt.imshow(board, cmap="Greys")
     
@@ -71,14 +759,14 @@ def update_board(board:np.array) -> AxesImage:
     return plot
 
 
-def pyplot_animation_of_life(initial_board:np.array, iterations:int, delay:Union[float, int], plotting_function:Callable[[np.array], AxesImage]) -> animation.FuncAnimation:
+def pyplot_animation_of_life(initial_board:np.array, iterations:int, delay:Union[float, int], plotting_function:Callable[[np.array], AxesImage], detector:Optional[CycleDetector]=None) -> animation.FuncAnimation:
     fig = plt.gcf()
     anim = animation.FuncAnimation(
         fig,
         plotting_function,
         interval=delay*1000,
         repeat_delay=5*1000,
-        frames=next_life_generation(initial_board, iterations)
+        frames=next_life_generation(initial_board, iterations, detector=detector, stop_on_cycle=detector is not None)
         )
     
     return anim
@@ -98,10 +786,13 @@ def main():
     GENERATIONS = 200
     
     board = rng.random(SIZE) > CUTOFF
-    anim = pyplot_animation_of_life(board, GENERATIONS, 0.0001, update_board)
+    detector = CycleDetector()
+    anim = pyplot_animation_of_life(board, GENERATIONS, 0.0001, update_board, detector=detector)
     
     filepath = os.path.join(output_folder, f"life (seed={SEED}, size={SIZE}, cutoff={CUTOFF}, generations={GENERATIONS}).gif")
     anim.save(filepath, writer="pillow")
+    if detector.period is not None:
+        print(f"Stopped at generation {detector.first_repeat}: cycle of period {detector.period}.")
     # plt.show()
 
 if __name__ == "__main__":
@@ -1,15 +1,16 @@
 from turtle import width
+import os
 import numba
 import numpy as np
 import matplotlib.pyplot as plt
+from collections import OrderedDict
+from typing import Optional
 from tqdm import trange
 
 
 # Some from: https://realpython.com/mandelbrot-set-python/
 # Mine is the visualization
 
-np.warnings.filterwarnings("ignore")
-
 def sequence(c, z=0):
     while True:
         yield z
@@ -33,8 +34,9 @@ def complex_matrix(left, right, bottom, top, pixel_density=None, width=None):
 
 def is_stable(c, num_iterations=20):
     z = 0
-    for _ in trange(num_iterations):
-        z = z ** 2 + c
+    with np.errstate(over="ignore", invalid="ignore"): # escaped points keep growing until they overflow
+        for _ in trange(num_iterations):
+            z = z ** 2 + c
     return abs(z) <= 2
 
 def get_members(c, num_iterations=20):
@@ -44,12 +46,123 @@ def get_members(c, num_iterations=20):
 def iterations_til_escape(c:np.array, max_iterations=20):
     results = np.zeros(c.shape) - 1
     z = 0
-    for i in trange(max_iterations):
-        z = z ** 2 + c
-        results[np.logical_and(results == -1, abs(z) >= 2)] = i
+    with np.errstate(over="ignore", invalid="ignore"): # escaped points keep growing until they overflow
+        for i in trange(max_iterations):
+            z = z ** 2 + c
+            results[np.logical_and(results == -1, abs(z) >= 2)] = i
     results[results == -1] = max_iterations * 1.5
     return results
 
+def escape_time(c:np.array, max_iterations=20, smooth=False, bailout=2.0) -> np.array:
+    """
+    Same values as `iterations_til_escape`, but only the points that haven't escaped yet are iterated:
+    escaped points are dropped from the working set, so nothing overflows and the arrays shrink as points escape.
+    With `smooth`, escaped points get a fractional count (i + 1 - log2(log|z|)) instead of i,
+    which removes the banding (a larger `bailout` makes it smoother).
+    """
+    shape = np.shape(c)
+    results = np.full(c.size, max_iterations * 1.5)
+    index = np.arange(c.size)
+    c = c.ravel().astype(np.complex128)
+    z = np.zeros_like(c)
+    norm = np.empty(c.size)
+    bailout_squared = bailout ** 2
+    for i in trange(max_iterations):
+        np.multiply(z, z, out=z)
+        z += c
+        np.multiply(z.real, z.real, out=norm)
+        norm += z.imag * z.imag
+        escaped = norm >= bailout_squared
+        if not escaped.any():
+            continue
+        if smooth:
+            results[index[escaped]] = i + 1 - np.log2(np.log(np.sqrt(norm[escaped])))
+        else:
+            results[index[escaped]] = i
+        # Compact the working set.
+        active = ~escaped
+        index, c, z, norm = index[active], c[active], z[active], norm[active]
+        if index.size == 0:
+            break
+    return results.reshape(shape)
+
+@numba.njit(cache=True, inline="always")
+def _pixel_escape(zr, zi, cr, ci, max_iterations, check_interior, tolerance):
+    """
+    Escape count of one point, with the same values as `iterations_til_escape`.
+    An orbit that comes back within `tolerance` of a saved point is taken as periodic (inside); 0 turns that check off.
+    """
+    inside = max_iterations * 1.5
+    if check_interior:
+        # Main cardioid and period-2 bulb: known to be in the set.
+        x = cr - 0.25
+        q = x * x + ci * ci
+        if q * (q + x) <= 0.25 * ci * ci or (cr + 1) * (cr + 1) + ci * ci <= 0.0625:
+            return inside
+    # Periodicity check: compare with a saved point, saved again at every power of two (Brent).
+    old_r, old_i = zr, zi
+    check, checked = 2, 0
+    for i in range(max_iterations):
+        zr, zi = zr * zr - zi * zi + cr, 2 * zr * zi + ci
+        if zr * zr + zi * zi >= 4:
+            return i
+        if abs(zr - old_r) < tolerance and abs(zi - old_i) < tolerance:
+            return inside
+        checked += 1
+        if checked == check:
+            old_r, old_i = zr, zi
+            check *= 2
+            checked = 0
+    return inside
+
+
+def periodicity_tolerance(spacing:float) -> float:
+    """
+    Default tolerance of the periodicity check for pixels `spacing` apart: a millionth of a pixel, and never more than 1e-14.
+    A fixed tolerance gets coarse compared to the pixels in deep zooms, where slowly escaping orbits can come back that close.
+    """
+    return min(1e-14, abs(spacing) * 1e-6)
+
+
+@numba.njit(parallel=True, cache=True)
+def _render_tiles(re, im, cr, ci, julia, max_iterations, tile_size, tolerance):
+    height, width = im.shape[0], re.shape[0]
+    results = np.empty((height, width))
+    tiles_y = (height + tile_size - 1) // tile_size
+    tiles_x = (width + tile_size - 1) // tile_size
+    for t in numba.prange(tiles_y * tiles_x):
+        y0 = (t // tiles_x) * tile_size
+        x0 = (t % tiles_x) * tile_size
+        for y in range(y0, min(y0 + tile_size, height)):
+            for x in range(x0, min(x0 + tile_size, width)):
+                if julia:
+                    results[y, x] = _pixel_escape(re[x], im[y], cr, ci, max_iterations, False, tolerance)
+                else:
+                    results[y, x] = _pixel_escape(0.0, 0.0, re[x], im[y], max_iterations, True, tolerance)
+    return results
+
+
+def render(left, right, bottom, top, pixel_density=None, width=None, max_iterations=20, kind="mandelbrot",
+           parameter=0j, tile_size=32, tolerance=None) -> np.array:
+    """
+    Escape counts on the same grid as `complex_matrix`, computed by a compiled kernel on all cores.
+    `kind` is "mandelbrot" (z starts at 0, c is the pixel) or "julia" (z starts at the pixel, c is `parameter`).
+    The image is cut in tiles that are handed out one by one, so the cores that get cheap tiles pick up more of them.
+    `tolerance` is for the periodicity check (see `periodicity_tolerance`, the default); 0 turns the check off.
+    """
+    if kind not in ("mandelbrot", "julia"):
+        raise ValueError("`kind` must be 'mandelbrot' or 'julia'.")
+    if width is None:
+        width = int((right - left) * pixel_density)
+    height = int(width / (right - left) * (top - bottom))
+    re = np.linspace(left, right, width)
+    im = np.linspace(bottom, top, height)
+    if tolerance is None:
+        tolerance = periodicity_tolerance(re[1] - re[0])
+    with numba.parallel_chunksize(1):
+        return _render_tiles(re, im, parameter.real, parameter.imag, kind == "julia", max_iterations, tile_size, tolerance)
+    
+
 def get_boundaries(center, width, height, pos='center'):
     if pos == 'center':
         left, right = center[0] - width/2, center[0] + width/2
@@ -62,7 +175,7 @@ def get_boundaries(center, width, height, pos='center'):
 
 def plot_mandelbrot(left, right, bottom, top, pixel_density=None, width=None, iterations=20, save_path=None):
     c = complex_matrix(left, right, bottom, top, pixel_density=pixel_density, width=width)
-    plt.imshow(iterations_til_escape(c, iterations), cmap="magma", extent=(left, right, bottom, top))
+    plt.imshow(escape_time(c, iterations), cmap="magma", extent=(left, right, bottom, top))
     
     plt.gca().set_aspect("equal")
     # plt.axis("off")
@@ -77,12 +190,342 @@ def plot_mandelbrot(left, right, bottom, top, pixel_density=None, width=None, it
     
     plt.show(block=True)
     
-def zoom_to_point(point_x, point_y, current_width, current_height, zoom_multiplier=2):
+def reference_orbit(center_x, center_y, max_iterations:int, digits:int) -> np.array:
+    """
+    Orbit of the center point computed with `digits` decimal digits, rounded to complex128.
+    Stops after the point escapes (the escaped point is included).
+    """
+    from decimal import Decimal, localcontext
+    with localcontext() as context:
+        context.prec = digits
+        cr, ci = Decimal(str(center_x)), Decimal(str(center_y))
+        zr, zi = Decimal(0), Decimal(0)
+        orbit = [0j]
+        for _ in range(max_iterations):
+            zr, zi = zr * zr - zi * zi + cr, 2 * zr * zi + ci
+            orbit.append(complex(float(zr), float(zi)))
+            if zr * zr + zi * zi >= 4:
+                break
+    return np.array(orbit)
+
+
+def series_skip(orbit:np.array, radius:float, tolerance:float=1e-6) -> tuple[int, np.array]:
+    """
+    Series approximation delta_n = A delta_c + B delta_c**2 + C delta_c**3 around the reference orbit.
+    Returns how many iterations can be skipped for every |delta_c| <= `radius` (while the cubic term is still
+    negligible next to the linear one) and the coefficients (A, B, C) at that iteration.
+    """
+    a, b, c = 0j, 0j, 0j
+    skip, coefficients = 0, np.zeros(3, dtype=np.complex128)
+    for n in range(len(orbit) - 2): # the last points are needed to keep iterating normally
+        z = orbit[n]
+        a, b, c = 2 * z * a + 1, 2 * z * b + a * a, 2 * z * c + 2 * a * b
+        if not (np.isfinite(c) and abs(c) * radius ** 2 <= tolerance * abs(a)):
+            break
+        skip, coefficients = n + 1, np.array([a, b, c])
+    return skip, coefficients
+
+
+@numba.njit(parallel=True, cache=True)
+def _perturbation_kernel(orbit, dx, dy, skip, coefficients, max_iterations):
+    height, width = dy.shape[0], dx.shape[0]
+    results = np.empty((height, width))
+    last = orbit.shape[0] - 1
+    a, b, c = coefficients[0], coefficients[1], coefficients[2]
+    for y in numba.prange(height):
+        for x in range(width):
+            dc = complex(dx[x], dy[y])
+            dz = ((c * dc + b) * dc + a) * dc # delta after `skip` iterations, from the series
+            m = skip
+            results[y, x] = max_iterations * 1.5
+            for i in range(skip, max_iterations):
+                dz = 2 * orbit[m] * dz + dz * dz + dc
+                m += 1
+                z = orbit[m] + dz
+                if z.real * z.real + z.imag * z.imag >= 4:
+                    results[y, x] = i
+                    break
+                # Rebase onto the start of the orbit when the delta gets bigger than the point itself
+                # (where precision would be lost) or the reference orbit ran out.
+                if abs(z) < abs(dz) or m == last:
+                    dz = z
+                    m = 0
+    return results
+
+
+def render_deep(center_x, center_y, view_width, view_height, width:int=600, max_iterations=1000,
+                series_tolerance:float=1e-6) -> np.array:
+    """
+    Escape counts for views far too small for float64 (past about 1e-13), with the same values as `escape_time`.
+    Only the center is iterated in high precision (`center_x` and `center_y` can be strings or Decimals);
+    every pixel is iterated as a float64 difference from that reference orbit (perturbation), starting from the
+    series approximation so the first iterations are skipped. Row 0 is the bottom, like `complex_matrix`.
+    """
+    view_width, view_height = float(view_width), float(view_height)
+    height = int(width / view_width * view_height)
+    digits = max(30, int(-np.log10(view_width / width)) + 20)
+    orbit = reference_orbit(center_x, center_y, max_iterations, digits)
+    dx = np.linspace(-view_width / 2, view_width / 2, width)
+    dy = np.linspace(-view_height / 2, view_height / 2, height)
+    skip, coefficients = series_skip(orbit, np.hypot(view_width, view_height) / 2, series_tolerance)
+    return _perturbation_kernel(orbit, dx, dy, skip, coefficients, max_iterations)
+
+
+class TileCache:
+    """
+    Escape counts cut into square tiles of `tile_pixels` pixels, addressed like a quadtree:
+    at zoom level z a tile is 4 / 2**z wide, and tile (z, tx, ty) starts at (tx, ty) * its width.
+    Tiles are kept in memory with LRU eviction and, if `directory` is given, also saved to disk as .npy files.
+    """
+    base_size = 4.0
+    
+    def __init__(self, tile_pixels:int=256, max_tiles:int=512, directory=None):
+        self.tile_pixels = tile_pixels
+        self.max_tiles = max_tiles
+        self.directory = directory
+        self.tiles:OrderedDict = OrderedDict() # (zoom, tx, ty, max_iterations) -> (tile_pixels, tile_pixels) array
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            
+    def tile_size(self, zoom:int) -> float:
+        return self.base_size / 2**zoom
+    
+    def _path(self, key) -> str:
+        return os.path.join(self.directory, "tile_{}_{}_{}_{}_{}.npy".format(*key, self.tile_pixels))
+    
+    def _remember(self, key, tile:np.array) -> None:
+        self.tiles[key] = tile
+        self.tiles.move_to_end(key)
+        if len(self.tiles) > self.max_tiles:
+            self.tiles.popitem(last=False)
+            
+    def peek(self, zoom:int, tx:int, ty:int, max_iterations:int) -> Optional[np.array]:
+        """The tile if it is cached (in memory or on disk), without computing anything."""
+        key = (zoom, tx, ty, max_iterations)
+        if key in self.tiles:
+            self.tiles.move_to_end(key)
+            return self.tiles[key]
+        if self.directory is not None and os.path.exists(self._path(key)):
+            tile = np.load(self._path(key))
+            self._remember(key, tile)
+            return tile
+        return None
+    
+    def get(self, zoom:int, tx:int, ty:int, max_iterations:int) -> np.array:
+        tile = self.peek(zoom, tx, ty, max_iterations)
+        if tile is not None:
+            return tile
+        # Pixel centres, so neighboring tiles don't share a row or column.
+        size = self.tile_size(zoom)
+        offsets = (np.arange(self.tile_pixels) + 0.5) * size / self.tile_pixels
+        with numba.parallel_chunksize(1):
+            tile = _render_tiles(tx * size + offsets, ty * size + offsets, 0.0, 0.0, False, max_iterations, 32,
+                                 periodicity_tolerance(size / self.tile_pixels))
+        key = (zoom, tx, ty, max_iterations)
+        self._remember(key, tile)
+        if self.directory is not None:
+            np.save(self._path(key), tile)
+        return tile
+    
+    def zoom_for(self, left, right, width:int) -> int:
+        """The zoom level with (at least) one tile pixel per screen pixel."""
+        pixel_size = (right - left) / width
+        return max(0, int(np.ceil(np.log2(self.base_size / (self.tile_pixels * pixel_size)))))
+    
+    def view(self, left, right, bottom, top, width:int, max_iterations=20, zoom:Optional[int]=None) -> np.array:
+        """
+        The view on the same grid as `complex_matrix` (row 0 is `bottom`), put together from the tiles of `zoom`.
+        """
+        zoom = self.zoom_for(left, right, width) if zoom is None else zoom
+        height = int(width / (right - left) * (top - bottom))
+        pixel_size = self.tile_size(zoom) / self.tile_pixels
+        columns = np.floor(np.linspace(left, right, width) / pixel_size).astype(np.int64)
+        rows = np.floor(np.linspace(bottom, top, height) / pixel_size).astype(np.int64)
+        
+        image = np.empty((height, width))
+        for ty in np.unique(rows // self.tile_pixels):
+            in_ty = rows // self.tile_pixels == ty
+            for tx in np.unique(columns // self.tile_pixels):
+                in_tx = columns // self.tile_pixels == tx
+                tile = self.get(zoom, int(tx), int(ty), max_iterations)
+                image[np.ix_(in_ty, in_tx)] = tile[np.ix_(rows[in_ty] % self.tile_pixels, columns[in_tx] % self.tile_pixels)]
+        return image
+    
+    def progressive_view(self, left, right, bottom, top, width:int, max_iterations=20, steps:int=3):
+        """Yields the view `steps` times, from a coarse preview (3 zoom levels down = 1/64 of the work) to full detail."""
+        zoom = self.zoom_for(left, right, width)
+        for z in np.unique(np.linspace(max(zoom - 3, 0), zoom, steps).round().astype(int)):
+            yield self.view(left, right, bottom, top, width, max_iterations, zoom=int(z))
+            
+
+def plot_progressive(cache:TileCache, left, right, bottom, top, width=600, iterations=20):
+    """Like `plot_mandelbrot`, but shows a coarse preview first and refines it in place."""
+    plot = None
+    for image in cache.progressive_view(left, right, bottom, top, width, iterations):
+        if plot is None:
+            plot = plt.imshow(image, cmap="magma", extent=(left, right, bottom, top), origin="lower",
+                              vmin=0, vmax=iterations * 1.5)
+            plt.gca().set_aspect("equal")
+            plt.tight_layout()
+        else:
+            plot.set_data(image)
+        plt.pause(0.001)
+    plt.show(block=True)
+            
+    
+def zoom_to_point(point_x, point_y, current_width, current_height, zoom_multiplier=2, width=600, iterations=20, cache:Optional[TileCache]=None):
     new_width = current_width / zoom_multiplier
     new_height = current_height / zoom_multiplier
     left, right, bottom, top = get_boundaries((point_x, point_y), new_width, new_height)
-    plot_mandelbrot(left, right, bottom, top, )
+    if cache is not None:
+        # Reuses every tile already seen at this zoom level and iteration count.
+        plot_progressive(cache, left, right, bottom, top, width=width, iterations=iterations)
+    else:
+        plot_mandelbrot(left, right, bottom, top, width=width, iterations=iterations)
+    
+@numba.njit(parallel=True, cache=True)
+def _render_points(cr, ci, max_iterations, tolerance):
+    results = np.empty(cr.shape[0])
+    for k in numba.prange(cr.shape[0]):
+        results[k] = _pixel_escape(0.0, 0.0, cr[k], ci[k], max_iterations, True, tolerance)
+    return results
+
+
+def _reusable(new_coordinates:np.array, old_coordinates:np.array) -> np.array:
+    """For every new coordinate, the index of the old one it falls on (to within 1e-6 pixel), or -1."""
+    spacing = old_coordinates[1] - old_coordinates[0]
+    position = (new_coordinates - old_coordinates[0]) / spacing
+    index = np.round(position).astype(np.int64)
+    on_grid = (np.abs(position - index) < 1e-6) & (index >= 0) & (index < len(old_coordinates))
+    return np.where(on_grid, index, -1)
+
+
+def _render_zoom_segment(task) -> list[np.array]:
+    """
+    Renders consecutive frames of a zoom movie (in a worker process), as colormap indices (top row first).
+    Pixels that fall exactly on a pixel of an earlier frame of the segment are copied instead of computed.
+    """
+    views, width, height, max_iterations = task
+    earlier = [] # (re, im, counts) of the frames rendered so far
+    frames = []
+    for left, right, bottom, top in views:
+        re, im = np.linspace(left, right, width), np.linspace(bottom, top, height)
+        counts = np.full((height, width), np.nan)
+        for old_re, old_im, old_counts in reversed(earlier):
+            columns, rows = _reusable(re, old_re), _reusable(im, old_im)
+            if (columns >= 0).any() and (rows >= 0).any():
+                y, x = np.ix_(np.nonzero(rows >= 0)[0], np.nonzero(columns >= 0)[0])
+                counts[y, x] = np.where(np.isnan(counts[y, x]), old_counts[rows[y], columns[x]], counts[y, x])
+        missing = np.isnan(counts)
+        y, x = np.nonzero(missing)
+        counts[missing] = _render_points(re[x], im[y], max_iterations, periodicity_tolerance(re[1] - re[0]))
+        earlier.append((re, im, counts))
+        
+        levels = np.minimum(counts / (max_iterations * 1.5) * 255, 255).astype(np.uint8)
+        frames.append(levels[::-1])
+    return frames
+
+
+# Same GifSink, RawSink and FFmpegSink as in boids/boids.py; keep the copies identical.
+class GifSink:
+    """Writes indexed frames to a GIF one at a time (PillowWriter keeps every frame in memory until the end)."""
+    def __init__(self, filename, palette:np.array, fps:int=60):
+        from PIL import Image
+        self.Image = Image
+        self.file = open(filename, "wb")
+        self.palette = np.zeros((256, 3), dtype=np.uint8)
+        self.palette[:len(palette)] = palette
+        self.duration = round(1000 / fps)
+        self.started = False
+        
+    def write(self, frame:np.array) -> None:
+        from PIL import GifImagePlugin
+        image = self.Image.fromarray(frame, mode="P")
+        image.putpalette(self.palette.tobytes())
+        if not self.started:
+            header, _ = GifImagePlugin.getheader(image, None, {"loop": 0, "duration": self.duration})
+            self.file.writelines(header)
+            self.started = True
+        self.file.writelines(GifImagePlugin.getdata(image, duration=self.duration))
+        
+    def close(self) -> None:
+        self.file.write(b";") # GIF trailer
+        self.file.close()
+        
+        
+class RawSink:
+    """Appends every frame as raw rgb24 bytes (read back with `np.fromfile(...).reshape(-1, height, width, 3)`)."""
+    def __init__(self, filename, palette:np.array):
+        self.file = open(filename, "wb")
+        self.palette = palette
+        
+    def write(self, frame:np.array) -> None:
+        self.file.write(self.palette[frame].tobytes())
+        
+    def close(self) -> None:
+        self.file.close()
+        
+        
+class FFmpegSink(RawSink):
+    """Pipes rgb24 frames into an ffmpeg process (needs `ffmpeg` on the PATH)."""
+    def __init__(self, filename, palette:np.array, size:tuple[int, int], fps:int=60):
+        import subprocess
+        height, width = size
+        self.process = subprocess.Popen(
+            ["ffmpeg", "-y", "-loglevel", "error",
+             "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", str(fps), "-i", "-",
+             "-pix_fmt", "yuv420p", "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", str(filename)],
+            stdin=subprocess.PIPE)
+        self.file = self.process.stdin
+        self.palette = palette
+        
+    def close(self) -> None:
+        self.file.close()
+        if self.process.wait() != 0:
+            raise RuntimeError(f"ffmpeg exited with code {self.process.returncode}.")
+
+
+def render_zoom_movie(filename, point_x, point_y, start_width, start_height, frames:int, zoom_multiplier=2**(1/4),
+                      width=601, max_iterations=256, fps=30, cmap="magma", processes=None, segment_length=16) -> None:
+    """
+    Zooms into (point_x, point_y) by `zoom_multiplier` per frame (the same steps as `zoom_to_point`) and streams the
+    colormapped frames to `filename`: .gif, a video format through ffmpeg (.mp4, .webm, ...) or raw rgb24 frames otherwise.
+    Frames are rendered in worker processes, `segment_length` consecutive frames per task. Inside a segment, pixels
+    landing exactly on an earlier frame's pixel are reused: with an odd `width` and a zoom multiplier whose powers hit 2,
+    a quarter of each frame comes from the frame one doubling earlier.
+    """
+    import multiprocessing
+    from matplotlib import colormaps
+    from tqdm import tqdm
     
+    height = int(round(width * start_height / start_width)) | 1 # odd, so the center falls on a pixel
+    views = []
+    current_width, current_height = start_width, start_height
+    for _ in range(frames):
+        views.append(get_boundaries((point_x, point_y), current_width, current_height))
+        current_width, current_height = current_width / zoom_multiplier, current_height / zoom_multiplier
+    tasks = [(views[k:k + segment_length], width, height, max_iterations) for k in range(0, frames, segment_length)]
+    
+    palette = (colormaps[cmap](np.linspace(0, 1, 256))[:, :3] * 255).round().astype(np.uint8)
+    extension = os.path.splitext(str(filename))[1].lower()
+    if extension == ".gif":
+        sink = GifSink(filename, palette, fps=fps)
+    elif extension in (".mp4", ".mkv", ".webm", ".mov", ".avi"):
+        sink = FFmpegSink(filename, palette, size=(height, width), fps=fps)
+    else:
+        sink = RawSink(filename, palette)
+    
+    try:
+        # "spawn": numba's thread pool doesn't survive being forked.
+        with multiprocessing.get_context("spawn").Pool(processes) as pool, tqdm(total=frames) as progress:
+            for segment in pool.imap(_render_zoom_segment, tasks): # in order, while later segments render
+                for frame in segment:
+                    sink.write(frame)
+                progress.update(len(segment))
+    finally:
+        sink.close()
+    
+
 def main():
     import os
     output_folder_path = os.path.join(os.path.realpath(__file__), os.pardir, "output")
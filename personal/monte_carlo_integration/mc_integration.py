@@ -1,10 +1,77 @@
 import numpy as np
 import matplotlib.pyplot as plt
 import numba
+from collections import OrderedDict
+from statistics import NormalDist
+from typing import NamedTuple
 
 SEED = np.random.randint(10**6, 10**7-1)
 rng  = np.random.default_rng(SEED)
 
+FUNCTION_SIGNATURE = [numba.float64(numba.float64)]
+RULE_SIGNATURE = [numba.float64(numba.float64, numba.float64)]
+KERNEL_CACHE_SIZE = 128
+_kernel_cache:OrderedDict = OrderedDict()
+
+
+def _global_names(code) -> set:
+    """Names `code` (and the functions defined inside it) may look up as globals."""
+    names = set(code.co_names)
+    for constant in code.co_consts:
+        if hasattr(constant, "co_names"):
+            names |= _global_names(constant)
+    return names
+
+
+def _kernel_key(function, *kind):
+    """
+    What identifies the compiled version of `function`: its code, the values it closes over, its defaults and the
+    current values of the globals it uses (numba freezes those into the machine code, so changing one needs a new kernel).
+    None if any of those can't be hashed (then it is compiled every time).
+    """
+    code = getattr(function, "__code__", None)
+    if code is None:
+        return None
+    closure = tuple(cell.cell_contents for cell in function.__closure__ or ())
+    namespace = function.__globals__
+    global_values = tuple((name, namespace[name]) for name in sorted(_global_names(code)) if name in namespace)
+    key = (code, closure, function.__defaults__, id(namespace), global_values, kind)
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def _cached_kernel(function, build, *kind):
+    """`build()`, or the result of an earlier call for the same function and `kind`. Least recently used ones are evicted."""
+    key = _kernel_key(function, *kind)
+    if key is None:
+        return build()
+    if key in _kernel_cache:
+        _kernel_cache.move_to_end(key)
+        return _kernel_cache[key]
+    kernel = _kernel_cache[key] = build()
+    if len(_kernel_cache) > KERNEL_CACHE_SIZE:
+        _kernel_cache.popitem(last=False)
+    return kernel
+
+
+def compile_kernel(function, signature=FUNCTION_SIGNATURE, target='parallel', persist=False):
+    """
+    `numba.vectorize(signature, target=target)(function)`, compiled once per function (see `_kernel_key`).
+    With `persist`, numba also keeps the machine code on disk for the next run (only for functions defined in a file).
+    """
+    def build():
+        if persist:
+            try:
+                return numba.vectorize(signature, target=target, cache=True)(function)
+            except Exception:
+                pass # functions that numba can't cache (defined in the interpreter, ...) are just compiled
+        return numba.vectorize(signature, target=target)(function)
+    
+    return _cached_kernel(function, build, "vectorize", tuple(str(s) for s in signature), target, persist)
+
 def integrate_function_using_rule(function, start_x, end_x, num_points, plot=True):
     f = np.vectorize(function)
     xx = np.arange(start_x, end_x, (end_x-start_x)/num_points)
@@ -27,7 +94,7 @@ def integrate_function_using_rule(function, start_x, end_x, num_points, plot=Tru
     return area_under_curve
 
 def integrate(function, start_x, end_x, num_points, plot=True):
-    f = numba.vectorize([numba.float64(numba.float64)], target='parallel')(function)
+    f = compile_kernel(function)
     xx = np.linspace(start_x, end_x, num_points)
     f_x = f(xx)
     min_y = min(f_x.min(), 0)
@@ -67,7 +134,7 @@ def integrate_rule(rule, min_x=None, max_x=None, min_y=None, max_y=None, num_poi
         xx = rng.uniform(min_x, max_x, num_points)
         yy = rng.uniform(min_y, max_y, num_points)
     
-    rule = numba.vectorize([numba.float64(numba.float64, numba.float64)], target='parallel')(rule)
+    rule = compile_kernel(rule, RULE_SIGNATURE)
     points_ruled = rule(xx, yy)
     total_area = (max_y - min_y) * (max_x - min_x)
     
@@ -82,6 +149,332 @@ def integrate_rule(rule, min_x=None, max_x=None, min_y=None, max_y=None, num_poi
     
     return points_ruled.sum() / num_points * total_area
 
+class Estimate(NamedTuple):
+    value: float
+    standard_error: float
+    interval: tuple[float, float] # confidence interval around `value`
+    num_points: int
+    
+    
+class RunningStats:
+    """Count, mean and sum of squared deviations of a stream, updated one chunk at a time (Chan et al.)."""
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        
+    def update(self, values:np.array) -> None:
+        if len(values) == 0:
+            return
+        chunk_mean = values.mean()
+        self.merge(len(values), chunk_mean, ((values - chunk_mean) ** 2).sum())
+        
+    def update_sums(self, n:int, total:float, total_squares:float) -> None:
+        """Adds a chunk given only its size, sum and sum of squares."""
+        if n == 0:
+            return
+        chunk_mean = total / n
+        self.merge(n, chunk_mean, max(total_squares - total * chunk_mean, 0.0))
+        
+    def merge(self, n:int, chunk_mean:float, chunk_m2:float) -> None:
+        delta = chunk_mean - self.mean
+        total = self.count + n
+        self.mean += delta * n / total
+        self.m2 += chunk_m2 + delta ** 2 * self.count * n / total
+        self.count = total
+        
+    @property
+    def standard_error(self) -> float:
+        if self.count < 2:
+            return float("inf")
+        return float(np.sqrt(self.m2 / (self.count - 1) / self.count))
+    
+    def estimate(self, scale:float=1.0, confidence:float=0.95) -> Estimate:
+        z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        value, error = float(self.mean * scale), float(self.standard_error * abs(scale))
+        return Estimate(value, error, (value - z * error, value + z * error), self.count)
+    
+    
+def _stream(sample_chunk, num_points, chunk_size, target_error, confidence, scale) -> Estimate:
+    """Feeds chunks from `sample_chunk(size)` into a `RunningStats` until `num_points` or `target_error` is reached."""
+    stats = RunningStats()
+    while stats.count < num_points:
+        stats.update(sample_chunk(min(chunk_size, num_points - stats.count)))
+        if target_error is not None and stats.standard_error * abs(scale) <= target_error:
+            break
+    return stats.estimate(scale, confidence)
+
+
+def integrate_streaming(function, start_x, end_x, num_points, chunk_size=1_000_000, target_error=None, confidence=0.95) -> Estimate:
+    """
+    Same hit-or-miss estimate as `integrate`, but the points are drawn in chunks of `chunk_size`, so memory use
+    doesn't depend on `num_points`. Stops early once the standard error is at most `target_error`.
+    The bounding box comes from evaluating `function` on `chunk_size` evenly spaced points, like `integrate` does.
+    """
+    f = compile_kernel(function)
+    f_x = f(np.linspace(start_x, end_x, min(num_points, chunk_size)))
+    min_y = min(f_x.min(), 0)
+    max_y = max(f_x.max(), 0)
+    total_area = (max_y - min_y) * (end_x - start_x)
+    
+    def sample_chunk(size):
+        xx = rng.uniform(start_x, end_x, size)
+        yy = rng.uniform(min_y, max_y, size)
+        f_x = f(xx)
+        # +1 under a positive part of the curve, -1 above a negative part.
+        return ((0 < yy) & (yy < f_x)).astype(np.float64) - ((0 > yy) & (yy > f_x))
+    
+    return _stream(sample_chunk, num_points, chunk_size, target_error, confidence, total_area)
+
+
+def integrate_rule_streaming(rule, min_x, max_x, min_y, max_y, num_points, chunk_size=1_000_000, target_error=None, confidence=0.95) -> Estimate:
+    """`integrate_rule` drawing its points in chunks, with a standard error and optional early stop (see `integrate_streaming`)."""
+    rule = compile_kernel(rule, RULE_SIGNATURE)
+    total_area = (max_y - min_y) * (max_x - min_x)
+    
+    def sample_chunk(size):
+        return rule(rng.uniform(min_x, max_x, size), rng.uniform(min_y, max_y, size))
+    
+    return _stream(sample_chunk, num_points, chunk_size, target_error, confidence, total_area)
+
+
+def _parallel_blocks(block_sums, num_points, block_size, seed, workers) -> RunningStats:
+    """
+    Splits `num_points` into blocks of `block_size` and runs `block_sums(generator, size)` for each one on a thread pool.
+    Block i always gets the i-th stream spawned from `seed` and the block sums are combined in block order,
+    so the result is the same bit for bit whatever the number of workers.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    sizes = [min(block_size, num_points - start) for start in range(0, num_points, block_size)]
+    streams = np.random.SeedSequence(seed).spawn(len(sizes))
+    
+    def run(block):
+        return block_sums(np.random.default_rng(streams[block]), sizes[block])
+    
+    stats = RunningStats()
+    with ThreadPoolExecutor(workers) as pool:
+        for n, total, total_squares in pool.map(run, range(len(sizes))):
+            stats.update_sums(n, total, total_squares)
+    return stats
+
+
+def _hits_kernel(function):
+    """Compiled (nogil) sum and sum of squares of the hit-or-miss values of the points (xx, yy)."""
+    f = numba.njit(nogil=True)(function)
+    
+    @numba.njit(nogil=True)
+    def hits(xx, yy):
+        total = 0.0
+        total_squares = 0.0
+        for k in range(xx.shape[0]):
+            f_x = f(xx[k])
+            if 0 < yy[k] < f_x or 0 > yy[k] > f_x:
+                total += 1 if yy[k] > 0 else -1
+                total_squares += 1
+        return total, total_squares
+    
+    return hits
+
+
+def _weights_kernel(rule):
+    """Compiled (nogil) sum and sum of squares of `rule` over the points (xx, yy)."""
+    r = numba.njit(nogil=True)(rule)
+    
+    @numba.njit(nogil=True)
+    def weights(xx, yy):
+        total = 0.0
+        total_squares = 0.0
+        for k in range(xx.shape[0]):
+            w = r(xx[k], yy[k]) * 1.0
+            total += w
+            total_squares += w * w
+        return total, total_squares
+    
+    return weights
+
+
+def integrate_parallel(function, start_x, end_x, num_points, seed=SEED, workers=None, block_size=1_000_000, confidence=0.95) -> Estimate:
+    """
+    Hit-or-miss estimate like `integrate_streaming`, with sampling and evaluation spread over `workers` threads.
+    Every block of points has its own random stream (see `_parallel_blocks`), and `function` is compiled with
+    `nogil`, so the threads really run at the same time. Reproducible from `seed` for any number of workers.
+    """
+    hits = _cached_kernel(function, lambda: _hits_kernel(function), "hits")
+    f_x = compile_kernel(function)(np.linspace(start_x, end_x, min(num_points, block_size)))
+    min_y = min(f_x.min(), 0)
+    max_y = max(f_x.max(), 0)
+    total_area = (max_y - min_y) * (end_x - start_x)
+    
+    def block_sums(generator, size):
+        total, total_squares = hits(generator.uniform(start_x, end_x, size), generator.uniform(min_y, max_y, size))
+        return size, total, total_squares
+    
+    return _parallel_blocks(block_sums, num_points, block_size, seed, workers).estimate(total_area, confidence)
+
+
+def integrate_rule_parallel(rule, min_x, max_x, min_y, max_y, num_points, seed=SEED, workers=None, block_size=1_000_000, confidence=0.95) -> Estimate:
+    """`integrate_rule` spread over `workers` threads, reproducible from `seed` for any number of workers (see `integrate_parallel`)."""
+    weights = _cached_kernel(rule, lambda: _weights_kernel(rule), "weights")
+    
+    def block_sums(generator, size):
+        total, total_squares = weights(generator.uniform(min_x, max_x, size), generator.uniform(min_y, max_y, size))
+        return size, total, total_squares
+    
+    total_area = (max_y - min_y) * (max_x - min_x)
+    return _parallel_blocks(block_sums, num_points, block_size, seed, workers).estimate(total_area, confidence)
+
+
+def integrate_nd(integrand, bounds, num_points, seed=SEED, workers=None, block_elements=2**22, confidence=0.95) -> Estimate:
+    """
+    Monte Carlo integral over the box given by `bounds` (a (min, max) pair per axis), in any number of dimensions.
+    `integrand` gets an (n, chunk) array of points (one row per axis) and returns one value per point;
+    a rule returning booleans gives the volume of the region instead (e.g. the n-ball: `(p * p).sum(axis=0) <= 1`).
+    Blocks hold about `block_elements` coordinates whatever the dimension, so memory and cache use stay the same,
+    and run on `workers` threads, reproducible from `seed` like `integrate_parallel`.
+    """
+    bounds = np.asarray(bounds, dtype=np.float64)
+    lows, widths = bounds[:, 0:1], bounds[:, 1:2] - bounds[:, 0:1]
+    volume = float(np.prod(widths))
+    
+    def block_sums(generator, size):
+        points = generator.random((len(bounds), size))
+        points *= widths
+        points += lows
+        values = np.asarray(integrand(points), dtype=np.float64)
+        return size, values.sum(), (values * values).sum()
+    
+    block_size = max(1, block_elements // len(bounds))
+    return _parallel_blocks(block_sums, num_points, block_size, seed, workers).estimate(volume, confidence)
+
+
+def integrate_mean_value(function, start_x, end_x, num_points, chunk_size=1_000_000, target_error=None, confidence=0.95) -> Estimate:
+    """Plain Monte Carlo: (end_x - start_x) times the mean of `function` at uniform random points. No bounding box needed."""
+    f = compile_kernel(function)
+    return _stream(lambda size: f(rng.uniform(start_x, end_x, size)),
+                   num_points, chunk_size, target_error, confidence, end_x - start_x)
+
+
+def integrate_antithetic(function, start_x, end_x, num_points, chunk_size=1_000_000, target_error=None, confidence=0.95) -> Estimate:
+    """Mean value with antithetic pairs: every x is used together with its mirror image start_x + end_x - x."""
+    f = compile_kernel(function)
+    
+    def sample_chunk(size):
+        xx = rng.uniform(start_x, end_x, size)
+        return (f(xx) + f(start_x + end_x - xx)) / 2
+    
+    # `num_points` counts evaluations, so there are half as many pairs (and the estimate reports evaluations too).
+    estimate = _stream(sample_chunk, num_points // 2, chunk_size, target_error, confidence, end_x - start_x)
+    return estimate._replace(num_points=2 * estimate.num_points)
+
+
+def integrate_stratified(function, start_x, end_x, num_points, chunk_size=1_000_000, target_error=None, confidence=0.95, strata=1024) -> Estimate:
+    """
+    Stratified sampling: [start_x, end_x] is cut in `strata` equal parts, each getting num_points // strata uniform points.
+    The variance only comes from inside the strata, not from how much the function changes between them.
+    Every stratum needs all its points, so there is no early stopping: `target_error` must be None.
+    Each stratum needs at least 2 points for its variance, so `num_points` must be at least 2 * `strata`.
+    """
+    if target_error is not None:
+        raise ValueError("Stratified sampling can't stop early, `target_error` must be None.")
+    if num_points < 2 * strata:
+        raise ValueError("`num_points` must be at least 2 * `strata` (2 points per stratum).")
+    f = compile_kernel(function)
+    per_stratum = num_points // strata
+    width = (end_x - start_x) / strata
+    value, variance = 0.0, 0.0
+    group = max(chunk_size // per_stratum, 1) # strata handled per chunk
+    for first in range(0, strata, group):
+        index = np.arange(first, min(first + group, strata))[:, np.newaxis]
+        f_x = f(start_x + (index + rng.random((len(index), per_stratum))) * width)
+        value += width * f_x.mean(axis=1).sum()
+        variance += (width ** 2 * f_x.var(axis=1, ddof=1) / per_stratum).sum()
+    error = float(np.sqrt(variance))
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    return Estimate(float(value), error, (float(value - z * error), float(value + z * error)), per_stratum * strata)
+
+
+def integrate_importance(function, density, sampler, num_points, chunk_size=1_000_000, target_error=None, confidence=0.95) -> Estimate:
+    """
+    Importance sampling: `sampler(rng, size)` draws points from a probability density, and `density(xx)` evaluates it
+    (both vectorized). The estimate is the mean of function(x) / density(x); it works best when the density
+    has roughly the shape of |function| and is never 0 where the function isn't.
+    """
+    f = compile_kernel(function)
+    
+    def sample_chunk(size):
+        xx = sampler(rng, size)
+        return f(xx) / density(xx)
+    
+    return _stream(sample_chunk, num_points, chunk_size, target_error, confidence, 1.0)
+
+
+def van_der_corput(start:int, stop:int) -> np.array:
+    """Points `start` to `stop` of the base-2 van der Corput sequence (the 1-d Halton sequence)."""
+    index = np.arange(start, stop, dtype=np.uint64)
+    points = np.zeros(len(index))
+    scale = 0.5
+    while index.any():
+        points += (index & np.uint64(1)) * scale
+        index >>= np.uint64(1)
+        scale /= 2
+    return points
+
+
+def integrate_qmc(function, start_x, end_x, num_points, chunk_size=1_000_000, target_error=None, confidence=0.95, method="halton", replicates=16) -> Estimate:
+    """
+    Randomized quasi-Monte Carlo: `replicates` independent randomizations of a low-discrepancy sequence
+    ("halton": van der Corput with a random shift modulo 1; "sobol": scrambled Sobol points, needs scipy),
+    each with num_points // replicates points. The error estimate comes from the spread between the replicates.
+    The error is only known once all replicates are done, so there is no early stopping: `target_error` must be None.
+    """
+    if target_error is not None:
+        raise ValueError("Quasi-Monte Carlo can't stop early, `target_error` must be None.")
+    if method not in ("halton", "sobol"):
+        raise ValueError("`method` must be 'halton' or 'sobol'.")
+    f = compile_kernel(function)
+    per_replicate = num_points // replicates
+    estimates = np.empty(replicates)
+    for r in range(replicates):
+        if method == "sobol":
+            from scipy.stats import qmc
+            sobol = qmc.Sobol(d=1, scramble=True, seed=rng)
+        else:
+            shift = rng.random()
+        total = 0.0
+        for start in range(0, per_replicate, chunk_size):
+            size = min(chunk_size, per_replicate - start)
+            if method == "sobol":
+                uu = sobol.random(size)[:, 0]
+            else:
+                uu = (van_der_corput(start, start + size) + shift) % 1
+            total += f(start_x + uu * (end_x - start_x)).sum()
+        estimates[r] = total / per_replicate * (end_x - start_x)
+    value = float(estimates.mean())
+    error = float(estimates.std(ddof=1) / np.sqrt(replicates))
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    return Estimate(value, error, (value - z * error, value + z * error), per_replicate * replicates)
+
+
+ESTIMATORS = {
+    "hit_or_miss": integrate_streaming,
+    "mean_value": integrate_mean_value,
+    "antithetic": integrate_antithetic,
+    "stratified": integrate_stratified,
+    "qmc": integrate_qmc,
+}
+
+
+def integrate_with(estimator, function, start_x, end_x, num_points, **kwargs) -> Estimate:
+    """
+    Integrates with one of the `ESTIMATORS` by name. They all take `chunk_size`, `target_error` and `confidence`
+    ("stratified" and "qmc" raise a ValueError for a `target_error`, they can't stop early); "stratified" also takes
+    `strata`, and "qmc" `method` and `replicates`. (Importance sampling needs a density, use `integrate_importance`.)
+    """
+    if estimator not in ESTIMATORS:
+        raise ValueError(f"`estimator` must be one of {', '.join(ESTIMATORS)}.")
+    return ESTIMATORS[estimator](function, start_x, end_x, num_points, **kwargs)
+
+
 def main():
     print(f"SEED: {SEED}")
     N = 100_000_000
@@ -97,6 +490,9 @@ def main():
     circle = lambda x, y: x ** 2 + y ** 2 < 1
     print(integrate_rule(circle, -1, 1, -1, 1, N, plot=plot))
     
+    ball = lambda points: (points * points).sum(axis=0) < 1
+    print(integrate_nd(ball, [(-1, 1)] * 5, N))
+    
     import math
     non_integratable_f = lambda x: math.sin(x ** 2)
     print(integrate(non_integratable_f, start_x=0, end_x=math.pi * 4, num_points=N, plot=plot))
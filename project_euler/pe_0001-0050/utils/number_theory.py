@@ -1,6 +1,67 @@
 import numpy as np
 import math
-from numba import njit
+import os
+from numba import njit, prange
+
+SEGMENT_SIZE = 2**18 # odd numbers per segment: 256 KB of flags, about the size of L2
+
+
+def _small_primes(limit:int) -> np.array:
+    """
+    Odd primes up to `limit` with a plain (one segment) odd-only sieve. Only used for the base primes up to sqrt(n).
+    
+    >>> _small_primes(30).tolist()
+    [3, 5, 7, 11, 13, 17, 19, 23, 29]
+    >>> _small_primes(0).tolist()
+    []
+    """
+    sieve = np.ones(max((limit - 1) // 2, 0), dtype=np.bool_) # sieve[i] is 2*i + 3
+    for i in range(int(math.isqrt(limit) - 1) // 2):
+        if sieve[i]:
+            p = 2 * i + 3
+            sieve[(p * p - 3) // 2::p] = False
+    return (np.flatnonzero(sieve) * 2 + 3).astype('int64')
+
+
+@njit
+def _sieve_segment(segment, low, base_primes):
+    """Crosses out the odd multiples of `base_primes` in `segment`, where segment[i] is low + 2*i (low is odd)."""
+    segment[:] = True
+    high = low + 2 * segment.shape[0]
+    for p in base_primes:
+        if p * p >= high:
+            break
+        start = max(p * p, (low + p - 1) // p * p)
+        if start % 2 == 0:
+            start += p
+        for i in range((start - low) // 2, segment.shape[0], p):
+            segment[i] = False
+
+
+def prime_segments(high:int, low:int=2, segment_size:int=SEGMENT_SIZE):
+    """
+    Yields the primes in [low, high] as numpy arrays, one segment at a time, so huge ranges never have to be in memory at once.
+    Only odd numbers are stored (one byte each), and only the base primes up to sqrt(high) are kept between segments.
+    
+    >>> [segment.tolist() for segment in prime_segments(30, segment_size=4)]
+    [[2], [3, 5, 7], [11, 13, 17], [19, 23], [29]]
+    >>> np.concatenate(list(prime_segments(110, low=90))).tolist()
+    [97, 101, 103, 107, 109]
+    >>> list(prime_segments(0))
+    []
+    """
+    if low <= 2 <= high:
+        yield np.array([2], dtype='int64')
+    base_primes = _small_primes(math.isqrt(high))
+    segment = np.empty(segment_size, dtype=np.bool_)
+    start = max(low, 3) | 1 # first odd number in range
+    while start <= high:
+        size = min(segment_size, (high - start) // 2 + 1)
+        _sieve_segment(segment[:size], start, base_primes)
+        primes = np.flatnonzero(segment[:size]) * 2 + start
+        yield primes.astype('int64')
+        start += 2 * size
+
 
 def primes_up_to_n(n) -> np.array:
     """
@@ -26,6 +87,8 @@ def primes_up_to_n(n) -> np.array:
     Traceback (most recent call last):
         ...
     ValueError: `n` has to be an integer value.
+    >>> len(primes_up_to_n(10**7))
+    664579
     """
     if n < 2:
         raise ValueError("`n` must be 2 or higher.")
@@ -36,12 +99,249 @@ def primes_up_to_n(n) -> np.array:
     if n == 3:
         return np.array([2, 3])
     
-    sieve = np.arange(3, n+1, 2, dtype='int64')
-    for i, m in enumerate(sieve):
-        if m > 0:
-            sieve[i+m::m] = 0
-    primes = np.concatenate((np.array([2]), sieve[sieve>0]))
-    return primes
+    return np.concatenate(list(prime_segments(int(n))))
+
+
+class PrimeTable:
+    """
+    Sorted array of all primes up to `limit` that grows on demand: asking about a bigger number only sieves the new range.
+    Queries are binary searches on the array. With a `cache_path`, the table is memory-mapped from that .npy file when
+    created and written back every time it grows, so later scripts start where the previous ones stopped.
+    
+    >>> table = PrimeTable()
+    >>> table.pi(100), table.nth(25), table.is_prime(97), table.is_prime(91)
+    (25, 97, True, False)
+    >>> table.limit >= 100
+    True
+    >>> table.primes_up_to(30).tolist()
+    [2, 3, 5, 7, 11, 13, 17, 19, 23, 29]
+    """
+    def __init__(self, cache_path:str=None):
+        self.cache_path = cache_path
+        self.limit = 1
+        self.primes = np.empty(0, dtype='int64')
+        if cache_path is not None and os.path.exists(cache_path):
+            stored = np.load(cache_path, mmap_mode='r') # [limit, 2, 3, 5, ...]
+            self.limit = int(stored[0])
+            self.primes = stored[1:]
+
+    def extend(self, n:int):
+        """Makes sure every prime up to `n` is in the table. Grows at least 2x at a time so many small extensions stay cheap."""
+        if n <= self.limit:
+            return
+        new_limit = max(int(n), 2 * self.limit, 2**16)
+        new_primes = list(prime_segments(new_limit, low=self.limit + 1))
+        self.primes = np.concatenate([self.primes] + new_primes)
+        self.limit = new_limit
+        if self.cache_path is not None:
+            self.save()
+
+    def save(self):
+        """Writes the table to `cache_path` (to a temporary file first, so a crash never leaves half a cache behind)."""
+        temporary = self.cache_path + ".tmp.npy"
+        np.save(temporary, np.concatenate([[self.limit], self.primes]).astype('int64'))
+        os.replace(temporary, self.cache_path)
+
+    def pi(self, x:int) -> int:
+        """Number of primes <= x."""
+        if x < 2:
+            return 0
+        self.extend(x)
+        return int(np.searchsorted(self.primes, x, side='right'))
+
+    def nth(self, k:int) -> int:
+        """The k-th prime, starting from nth(1) == 2."""
+        if k < 1:
+            raise ValueError("`k` must be 1 or higher.")
+        # p_k < k (ln k + ln ln k) for k >= 6
+        bound = 15 if k < 6 else int(k * (math.log(k) + math.log(math.log(k)))) + 1
+        self.extend(bound)
+        return int(self.primes[k - 1])
+
+    def is_prime(self, n:int) -> bool:
+        """
+        Binary search when n is in the table, otherwise trial division by the primes up to sqrt(n).
+        Beyond the table, the table grows to sqrt(n), which gets big: n around 1e18 means sieving to 1e9 (400 MB of primes).
+        n of 2**63 and up doesn't fit in int64, so it is trial-divided with Python ints instead, without growing the table
+        (fast when n has a small factor, very slow for a big prime).
+        """
+        if n < 2:
+            return False
+        if n <= self.limit:
+            i = np.searchsorted(self.primes, n)
+            return i < len(self.primes) and bool(self.primes[i] == n)
+        root = math.isqrt(n)
+        if n >= 2**63:
+            for p in self.primes:
+                if n % int(p) == 0:
+                    return False
+            return all(n % d != 0 for d in range(self.limit + 1 | 1, root + 1, 2))
+        self.extend(root)
+        return not np.any(n % self.primes[:self.pi(root)] == 0)
+
+    def primes_up_to(self, n:int) -> np.array:
+        """All primes <= n (a view into the table, don't write to it)."""
+        return self.primes[:self.pi(n)]
+
+
+# Shared by everything that imports this module. Set PRIME_TABLE_CACHE to a .npy path to keep the table between runs.
+prime_table = PrimeTable(os.environ.get("PRIME_TABLE_CACHE"))
+
+
+def nth_prime(k:int) -> int:
+    """
+    Returns the k-th prime (nth_prime(1) == 2).
+    
+    >>> nth_prime(1), nth_prime(6), nth_prime(10_001)
+    (2, 13, 104743)
+    """
+    return prime_table.nth(k)
+
+
+def prime_pi(x:int) -> int:
+    """
+    Returns the number of primes <= x.
+    
+    >>> prime_pi(1), prime_pi(2), prime_pi(10**6)
+    (0, 1, 78498)
+    """
+    return prime_table.pi(x)
+
+
+@njit
+def _linear_sieve(n):
+    spf = np.zeros(n + 1, dtype=np.int32)
+    primes = np.empty(n // 2 + 1, dtype=np.int32)
+    count = 0
+    for i in range(2, n + 1):
+        if spf[i] == 0:
+            spf[i] = i
+            primes[count] = i
+            count += 1
+        for j in range(count):
+            p = primes[j]
+            if p > spf[i] or i * p > n:
+                break
+            spf[i * p] = p # every composite gets crossed out exactly once, by its smallest prime
+    return spf
+
+
+def smallest_prime_factors(n:int) -> np.array:
+    """
+    Returns spf where spf[k] is the smallest prime factor of k, for k up to n (spf[0] and spf[1] are 0).
+    Linear sieve, O(n). 10^7 takes a fraction of a second and 40 MB.
+    
+    >>> smallest_prime_factors(12).tolist()
+    [0, 0, 2, 3, 2, 5, 2, 7, 2, 3, 2, 11, 2]
+    """
+    return _linear_sieve(int(n))
+
+
+def _spf_for(numbers, spf):
+    numbers = np.asarray(numbers, dtype='int64')
+    if numbers.size and numbers.min() < 1:
+        raise ValueError("`numbers` must all be 1 or higher.")
+    if spf is None:
+        spf = smallest_prime_factors(max(int(numbers.max(initial=1)), 1))
+    elif numbers.size and numbers.max() >= len(spf):
+        raise ValueError("`spf` table is too small for `numbers`.")
+    return numbers, spf
+
+
+@njit(parallel=True)
+def _factorize_kernel(numbers, spf, primes, exponents):
+    for i in prange(numbers.shape[0]):
+        m = numbers[i]
+        k = -1
+        while m > 1:
+            p = spf[m]
+            if k < 0 or primes[i, k] != p:
+                k += 1
+                primes[i, k] = p
+            exponents[i, k] += 1
+            m //= p
+
+
+@njit(parallel=True)
+def _multiplicative_kernel(numbers, spf, function):
+    # function: 0 = divisor count, 1 = divisor sum, 2 = totient
+    out = np.empty(numbers.shape[0], dtype=np.int64)
+    for i in prange(numbers.shape[0]):
+        m = numbers[i]
+        result = 1
+        while m > 1:
+            p = spf[m]
+            e = 0
+            power = 1
+            while m % p == 0:
+                m //= p
+                e += 1
+                power *= p
+            if function == 0:
+                result *= e + 1
+            elif function == 1:
+                result *= (power * p - 1) // (p - 1)
+            else:
+                result *= power // p * (p - 1)
+        out[i] = result
+    return out
+
+
+def factorizations(numbers:np.array, spf:np.array=None) -> tuple:
+    """
+    Factors every element of `numbers` at once. Returns (primes, exponents), both of shape (len(numbers), width), where
+    row i holds the distinct prime factors of numbers[i] in increasing order, padded with zeros up to the widest row.
+    Pass a table from smallest_prime_factors to reuse it, otherwise one is built up to max(numbers).
+    
+    >>> primes, exponents = factorizations([1, 12, 97, 360])
+    >>> primes.tolist()
+    [[0, 0, 0], [2, 3, 0], [97, 0, 0], [2, 3, 5]]
+    >>> exponents.tolist()
+    [[0, 0, 0], [2, 1, 0], [1, 0, 0], [3, 2, 1]]
+    """
+    numbers, spf = _spf_for(numbers, spf)
+    primorials = np.cumprod(primes_up_to_n(47).astype(float)) # 2, 2*3, 2*3*5, ...
+    width = max(int(np.searchsorted(primorials, numbers.max(initial=1), side='right')), 1) # most distinct primes possible
+    primes = np.zeros((len(numbers), width), dtype='int64')
+    exponents = np.zeros((len(numbers), width), dtype='int64')
+    _factorize_kernel(numbers, spf, primes, exponents)
+    width = max(int((primes > 0).sum(axis=1).max(initial=0)), 1)
+    return primes[:, :width], exponents[:, :width]
+
+
+def divisor_counts(numbers:np.array, spf:np.array=None) -> np.array:
+    """
+    Number of divisors of every element of `numbers`.
+    
+    >>> divisor_counts([1, 2, 12, 28, 360]).tolist()
+    [1, 2, 6, 6, 24]
+    """
+    numbers, spf = _spf_for(numbers, spf)
+    return _multiplicative_kernel(numbers, spf, 0)
+
+
+def divisor_sums(numbers:np.array, spf:np.array=None) -> np.array:
+    """
+    Sum of all divisors (including the number itself) of every element of `numbers`.
+    
+    >>> divisor_sums([1, 2, 12, 28, 220]).tolist()
+    [1, 3, 28, 56, 504]
+    """
+    numbers, spf = _spf_for(numbers, spf)
+    return _multiplicative_kernel(numbers, spf, 1)
+
+
+def totients(numbers:np.array, spf:np.array=None) -> np.array:
+    """
+    Euler's totient of every element of `numbers`.
+    
+    >>> totients([1, 2, 9, 10, 36, 97]).tolist()
+    [1, 1, 6, 4, 12, 96]
+    >>> int(totients(np.arange(1, 10**7 + 1)).sum())
+    30396356427242
+    """
+    numbers, spf = _spf_for(numbers, spf)
+    return _multiplicative_kernel(numbers, spf, 2)
 
 
 # def prime_factors(n:int) -> np.array:
@@ -73,18 +373,23 @@ def prime_factors(n:int) -> np.array:
     array([2])
     >>> prime_factors(10)
     array([2, 5])
+    >>> prime_factors(5)
+    array([5])
+    
+    For many numbers at once, use `factorizations`.
     """
-    limit = max(n//2 + 1, 5)
     divisors = []
     while n % 2 == 0:
         n = n // 2
         divisors.append(2)
-    for i in range(3, limit, 2): 
+    i = 3
+    while i * i <= n: # whatever is left after dividing out everything up to sqrt(n) is prime
         while n % i == 0:
             n = n // i
             divisors.append(i)
-        if n == 1:
-            break
+        i += 2
+    if n > 1:
+        divisors.append(n)
     return np.unique(divisors)
 
 def is_prime(n:int) -> bool:
@@ -97,11 +402,13 @@ def is_prime(n:int) -> bool:
     True
     >>> is_prime(1)
     False
+    >>> is_prime(2**31 - 1)
+    True
+    >>> is_prime(2**64 + 15)
+    False
     """
-    if n in [0, 1]:
-        return False
-    # Alternative: return all(n % i != 0 for i in range(2, n//2 + 1))
-    return len(prime_factors(n)) == 1
+    # Alternative: return len(prime_factors(n)) == 1
+    return prime_table.is_prime(n)
 
 if __name__ == "__main__":
     import doctest